@@ -1,178 +1,258 @@
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from html.parser import HTMLParser
 from pathlib import Path
-from collections import defaultdict
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import numpy as np
 
-from generate import PostMetadata
+from catalog import POSTS_DIR
+from generate import DIRECTIVES, PostMetadata, convert, get_catalog, preprocess
+
+# bump when the way stats are computed changes, to recount the words of every post
+STATS_VERSION = 3
+COUNT_FIELDS = ('prose_words', 'inline_code_words', 'code_words')
+# diagrams are images, don't run mermaid just to count words
+ANALYSIS_DIRECTIVES = {**DIRECTIVES, 'embed-mermaid': lambda ctx, fname: ''}
+
+
+@dataclass
+class PostStats:
+    content_hash: str
+    date: str
+    tags: list[str]
+    incomplete: bool
+    prose_words: int
+    inline_code_words: int
+    code_words: int
+
+    @property
+    def word_count(self) -> int:
+        # words that are read as part of the text; code blocks are counted separately
+        return self.prose_words + self.inline_code_words
+
+
+class WordCounter(HTMLParser):
+    """
+    Classifies the words of a rendered post in a single pass as prose,
+    inline code or code blocks; tags are not words.
+
+    Text is buffered until the next block boundary, so that words split over
+    several inline tags (eg: highlighted code) are counted once.
+    """
+    SKIP_TAGS = {'script', 'style'}
+    INLINE_TAGS = {'a', 'abbr', 'b', 'em', 'i', 'del', 's', 'small', 'span', 'strong', 'sub', 'sup'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.pre_depth = 0
+        self.code_depth = 0
+        self.skip_depth = 0
+        self.prose_words = 0
+        self.inline_code_words = 0
+        self.code_words = 0
+        self.pending = []
+        self.pending_kind = None
+
+    def flush(self):
+        words = len(''.join(self.pending).split())
+        if self.pending_kind == 'code':
+            self.code_words += words
+        elif self.pending_kind == 'inline_code':
+            self.inline_code_words += words
+        elif self.pending_kind == 'prose':
+            self.prose_words += words
+        self.pending = []
+        self.pending_kind = None
+
+    def close(self):
+        super().close()
+        self.flush()
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.INLINE_TAGS:
+            self.flush()
+        if tag == 'pre':
+            self.pre_depth += 1
+        elif tag == 'code':
+            self.code_depth += 1
+        elif tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag not in self.INLINE_TAGS:
+            self.flush()
+        if tag == 'pre':
+            self.pre_depth = max(0, self.pre_depth - 1)
+        elif tag == 'code':
+            self.code_depth = max(0, self.code_depth - 1)
+        elif tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.pre_depth:
+            kind = 'code'
+        elif self.code_depth:
+            kind = 'inline_code'
+        else:
+            kind = 'prose'
+        if kind != self.pending_kind:
+            self.flush()
+            self.pending_kind = kind
+        self.pending.append(data)
+
+
+def count_words(post_path, meta) -> WordCounter:
+    """
+    Counts the words of the converted markdown; the built page can't be used,
+    its large code blocks are collapsed and its casts replaced by posters.
+    """
+    content = post_path.read_text(encoding='utf-8')
+    text, _ = preprocess(post_path.parent, content, meta, ANALYSIS_DIRECTIVES)
+    counter = WordCounter()
+    counter.feed(convert(text))
+    counter.close()
+    return counter
+
+
+def load_post_stats():
+    """
+    Returns the stats for every post, keyed by post directory.
+    Word counts are kept in the metadata catalog, which resets them when a post
+    changes; only those posts are analyzed again.
+    """
+    catalog = get_catalog()
+    ret = {}
+    for row in catalog.posts(drafts=True):
+        name = row['dir']
+        if row['stats_version'] == STATS_VERSION:
+            counts = {field: row[field] for field in COUNT_FIELDS}
+        else:
+            print(f"analyzing {name}")
+            counter = count_words(POSTS_DIR / name / 'POST.md', PostMetadata.from_row(row, with_series=False))
+            counts = {field: getattr(counter, field) for field in COUNT_FIELDS}
+            catalog.set_stats(name, STATS_VERSION, **counts)
+        ret[name] = PostStats(content_hash=row['content_hash'],
+                              date=row['date'],
+                              tags=json.loads(row['tags']),
+                              incomplete=bool(row['draft']),
+                              **counts)
+    return ret
+
+
+def analyze_posts_with_gaps():
+    """Analyze all markdown posts including time gaps between posts."""
+    posts = [p for p in load_post_stats().values() if not p.incomplete]
 
+    dates = np.array([p.date for p in posts], dtype='datetime64[D]')
+    words = np.array([p.word_count for p in posts], dtype=np.int64)
+    code_words = np.array([p.code_words for p in posts], dtype=np.int64)
 
-def analyze_posts_with_gaps(directory):
-    """Analyze all markdown posts including time gaps between posts."""
-    yearly_stats = defaultdict(lambda: {'posts': 0, 'total_words': 0})
-    all_posts = []
-    
-    # Find all markdown files and collect their dates
-    for post_path in Path(directory).glob('*/POST.md'):
-        with open(post_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        post_data = PostMetadata.from_text(content)
-        if post_data.incomplete:
-            continue
-            
-        year = post_data.date.year
-        rest = "\n".join(content.split("---")[2:])
-        # there is a little bit of html counted as words (<img src=...>)
-        # maybe render this + read it back?
-        # more important would be to count code-words and non-code words separately
-        wc = len(str(rest).split())
-            
-        # Store post information
-        all_posts.append({
-            'date': post_data.date,
-            'word_count': wc
-        })
-        
-        # Update yearly statistics
-        yearly_stats[year]['posts'] += 1
-        yearly_stats[year]['total_words'] += wc
-    
     # Sort posts by date
-    all_posts.sort(key=lambda x: x['date'])
-    
-    # Calculate days between posts
-    gaps = []
-    dates = []
-    for i in range(1, len(all_posts)):
-        gap = (all_posts[i]['date'] - all_posts[i-1]['date']).days
-        gaps.append(gap)
-        dates.append(all_posts[i]['date'])
-    
-    # Calculate yearly stats as before
-    results = []
-    for year, stats in sorted(yearly_stats.items()):
-        avg_words = stats['total_words'] / stats['posts'] if stats['posts'] > 0 else 0
-        results.append({
-            'year': year,
-            'posts': stats['posts'],
-            'total_words': stats['total_words'],
-            'avg_words_per_post': round(avg_words, 2)
-        })
-
-    return results, (dates, gaps), all_posts
-
-
-def create_and_save_plots(stats, gap_data):
-    """Create and save individual plots as SVG files."""
-    # Extract data for plotting
-    years = [stat['year'] for stat in stats]  # Keep years as integers
-    years_str = [str(year) for year in years]  # String version for labels
-    posts = [stat['posts'] for stat in stats]
-    avg_words = [stat['avg_words_per_post'] for stat in stats]
-    total_words = [stat['total_words'] for stat in stats]
+    order = np.argsort(dates, kind='stable')
+    dates = dates[order]
+    words = words[order]
+    code_words = code_words[order]
 
-    # Common style settings
-    plt.style.use('default')
-    plot_kwargs = {
-        'figsize': (10, 6),
-        'dpi': 300
-    }
-    
-    # 1. Posts per Year
-    fig, ax = plt.subplots(**plot_kwargs)
-    bars = ax.bar(years, posts, color='#2196F3', alpha=0.7)
-    ax.set_title('Posts per Year', pad=15, fontsize=14)
-    ax.set_xlabel('Year', fontsize=12)
-    ax.set_ylabel('Number of Posts', fontsize=12)
+    # Calculate days between posts
+    gaps = np.diff(dates).astype(np.int64)
+
+    # Calculate yearly stats
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    uniq_years, year_idx = np.unique(years, return_inverse=True)
+    posts_per_year = np.bincount(year_idx)
+    words_per_year = np.bincount(year_idx, weights=words).astype(np.int64)
+    code_words_per_year = np.bincount(year_idx, weights=code_words).astype(np.int64)
+    avg_words = np.round(words_per_year / posts_per_year, 2)
+
+    results = [{
+            'year': int(year),
+            'posts': int(n),
+            'total_words': int(total),
+            'avg_words_per_post': float(avg),
+            'code_words': int(code),
+        } for year, n, total, avg, code in zip(uniq_years, posts_per_year, words_per_year, avg_words, code_words_per_year)]
+
+    date_list = dates.tolist()
+    all_posts = [{'date': d, 'word_count': int(wc)} for d, wc in zip(date_list, words)]
+    return results, (date_list[1:], gaps.tolist()), all_posts
+
+
+def year_axis(ax, years, fontsize):
+    ax.set_xlabel('Year', fontsize=fontsize)
     ax.set_xticks(years)
-    ax.set_xticklabels(years_str)
+    ax.set_xticklabels([str(year) for year in years])
     ax.grid(True, linestyle='--', alpha=0.7)
-    
-    # Add value labels on bars
+
+
+def label_bars(ax, bars, fontsize):
     for bar in bars:
         height = bar.get_height()
         ax.text(bar.get_x() + bar.get_width()/2., height,
-                f'{int(height)}',
-                ha='center', va='bottom')
-    
-    plt.tight_layout()
-    #plt.savefig('posts_per_year.svg', format='svg', bbox_inches='tight')
-    plt.close()
-    
-    # 2. Average Words per Post
-    fig, ax = plt.subplots(**plot_kwargs)
+                f'{int(height)}', ha='center', va='bottom', fontsize=fontsize)
+
+
+# Each chart is drawn by a single function onto a given axis, so the same
+# code is used for the individual SVGs and for the combined layout.
+# `small` is used for the combined layout.
+def draw_posts_per_year(ax, stats, gap_data, small):
+    years = [stat['year'] for stat in stats]
+    posts = [stat['posts'] for stat in stats]
+    bars = ax.bar(years, posts, color='#2196F3', alpha=0.7)
+    ax.set_title('Posts per Year', pad=15, fontsize=12 if small else 14)
+    ax.set_ylabel('Number of Posts', fontsize=10 if small else 12)
+    year_axis(ax, years, 10 if small else 12)
+    label_bars(ax, bars, 8 if small else None)
+
+
+def draw_avg_words_per_post(ax, stats, gap_data, small):
+    years = [stat['year'] for stat in stats]
+    avg_words = [stat['avg_words_per_post'] for stat in stats]
     ax.plot(years, avg_words, marker='o', color='#4CAF50', linewidth=2)
-    ax.set_title('Average Words per Post', pad=15, fontsize=14)
-    ax.set_xlabel('Year', fontsize=12)
-    ax.set_ylabel('Words', fontsize=12)
-    ax.set_xticks(years)
-    ax.set_xticklabels(years_str)
-    ax.grid(True, linestyle='--', alpha=0.7)
-    
-    # Add value labels
+    ax.set_title('Average Words per Post', pad=15, fontsize=12 if small else 14)
+    ax.set_ylabel('Words', fontsize=10 if small else 12)
+    year_axis(ax, years, 10 if small else 12)
     for x, y in zip(years, avg_words):
-        ax.text(x, y, f'{int(y)}', ha='center', va='bottom')
-    
-    plt.tight_layout()
-    #plt.savefig('avg_words_per_post.svg', format='svg', bbox_inches='tight')
-    plt.close()
-    
-    # 3. Total Words per Year
-    fig, ax = plt.subplots(**plot_kwargs)
+        ax.text(x, y, f'{int(y)}', ha='center', va='bottom', fontsize=8 if small else None)
+
+
+def draw_total_words_per_year(ax, stats, gap_data, small):
+    years = [stat['year'] for stat in stats]
+    total_words = [stat['total_words'] for stat in stats]
     bars = ax.bar(years, total_words, color='#FF9800', alpha=0.7)
-    ax.set_title('Total Words per Year', pad=15, fontsize=14)
-    ax.set_xlabel('Year', fontsize=12)
-    ax.set_ylabel('Words', fontsize=12)
-    ax.set_xticks(years)
-    ax.set_xticklabels(years_str)
-    ax.grid(True, linestyle='--', alpha=0.7)
-    
-    # Add value labels
-    for bar in bars:
-        height = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width()/2., height,
-                f'{int(height)}',
-                ha='center', va='bottom')
-    
-    plt.tight_layout()
-    #plt.savefig('total_words_per_year.svg', format='svg', bbox_inches='tight')
-    plt.close()
-    
-    # 4. Days Since Last Post
-    dates, gaps = gap_data
-    if dates and gaps:
-        fig, ax = plt.subplots(**plot_kwargs)
-        ax.plot(dates, gaps, marker='o', color='#9C27B0', linewidth=0, markersize=4)
-        ax.set_title('Days Since Last Post', pad=15, fontsize=14)
-        ax.set_xlabel('Date', fontsize=12)
-        ax.set_ylabel('Days', fontsize=12)
-        ax.set_yscale('linear')
-        ax.set_ylim(bottom=0, top=400)
-        ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda y, _: f'{int(y)}'))
-        ax.grid(True, linestyle='--', alpha=0.7)
-
-        # Format x-axis dates
-        ax.tick_params(axis='x', rotation=45)
-
-        plt.tight_layout()
-        #plt.savefig('days_since_last_post.svg', format='svg', bbox_inches='tight')
-        plt.close()
-
-
-def create_histogram_distribution_plot(stats, gap_data):
-    """Alternative visualization: histogram with variable-width bins."""
-    dates, gaps = gap_data
+    ax.set_title('Total Words per Year', pad=15, fontsize=12 if small else 14)
+    ax.set_ylabel('Words', fontsize=10 if small else 12)
+    year_axis(ax, years, 10 if small else 12)
+    label_bars(ax, bars, 8 if small else None)
+
 
+def draw_days_since_last_post(ax, stats, gap_data, small):
+    dates, gaps = gap_data
     if not dates or not gaps:
         return
+    ax.plot(dates, gaps, marker='o', color='#9C27B0', linewidth=0, markersize=4)
+    ax.set_title('Days Since Last Post', pad=15, fontsize=12 if small else 14)
+    ax.set_xlabel('Date', fontsize=10 if small else 12)
+    ax.set_ylabel('Days', fontsize=10 if small else 12)
+    ax.set_yscale('linear')
+    ax.set_ylim(bottom=0, top=300 if small else 400)
+    ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda y, _: f'{int(y)}'))
+    ax.grid(True, linestyle='--', alpha=0.7)
+    # Format x-axis dates
+    ax.tick_params(axis='x', rotation=45, labelsize=8 if small else None)
 
-    plot_kwargs = {
-        'figsize': (10, 6),
-        'dpi': 300
-    }
 
-    fig, ax = plt.subplots(**plot_kwargs)
+def draw_gap_histogram(ax, stats, gap_data, small):
+    """Alternative visualization: histogram with variable-width bins."""
+    dates, gaps = gap_data
+    if not dates or not gaps:
+        return
     # Custom bins: dense at low end (0-100), sparse at high end
     bins = list(range(0, 110, 10)) + [150, 200, 300, 500]
     counts, bin_edges = np.histogram(gaps, bins=bins)
@@ -190,30 +270,16 @@ def create_histogram_distribution_plot(stats, gap_data):
     ax.set_ylabel('Number of Gaps', fontsize=12)
     ax.grid(True, linestyle='--', alpha=0.7, axis='y')
 
-    plt.tight_layout()
-    plt.savefig('days_between_posts_histogram.svg', format='svg', bbox_inches='tight')
-    plt.close()
 
-
-def create_combined_plot(stats, gap_data, all_posts):
-    """Create a 2x2 combined plot with all four charts and a stats table."""
-    # Extract data for plotting
-    years = [stat['year'] for stat in stats]
-    years_str = [str(year) for year in years]
-    posts = [stat['posts'] for stat in stats]
-    avg_words = [stat['avg_words_per_post'] for stat in stats]
-    total_words = [stat['total_words'] for stat in stats]
-    dates, gaps = gap_data
-
-    # Calculate overall statistics
-    total_posts = sum(posts)
-    total_words_count = sum(total_words)
+def draw_overall_stats(ax, stats, all_posts):
+    total_posts = sum(stat['posts'] for stat in stats)
+    total_words_count = sum(stat['total_words'] for stat in stats)
 
     if all_posts and len(all_posts) > 1:
         first_post_date = all_posts[0]['date']
         last_post_date = all_posts[-1]['date']
         days_span = (last_post_date - first_post_date).days
-        avg_days_between_posts = days_span / (len(all_posts) - 1) if len(all_posts) > 1 else 0
+        avg_days_between_posts = days_span / (len(all_posts) - 1)
         years_span = days_span / 365.25
         avg_words_per_year = total_words_count / years_span if years_span > 0 else 0
         avg_posts_per_year = total_posts / years_span if years_span > 0 else 0
@@ -223,69 +289,7 @@ def create_combined_plot(stats, gap_data, all_posts):
         avg_words_per_year = 0
         avg_posts_per_year = 0
 
-    # Create figure with custom layout: 2x2 grid for plots, 1 narrow column for stats
-    fig = plt.figure(figsize=(18, 12), dpi=300)
-    gs = fig.add_gridspec(2, 3, width_ratios=[1, 1, 0.05], hspace=0.3, wspace=0.2)
-
-    ax1 = fig.add_subplot(gs[0, 0])
-    ax2 = fig.add_subplot(gs[0, 1])
-    ax3 = fig.add_subplot(gs[1, 0])
-    ax4 = fig.add_subplot(gs[1, 1])
-    ax_stats = fig.add_subplot(gs[:, 2])
-    
-    # 1. Posts per Year (top-left)
-    bars1 = ax1.bar(years, posts, color='#2196F3', alpha=0.7)
-    ax1.set_title('Posts per Year', pad=15, fontsize=12)
-    ax1.set_xlabel('Year', fontsize=10)
-    ax1.set_ylabel('Number of Posts', fontsize=10)
-    ax1.set_xticks(years)
-    ax1.set_xticklabels(years_str)
-    ax1.grid(True, linestyle='--', alpha=0.7)
-    for bar in bars1:
-        height = bar.get_height()
-        ax1.text(bar.get_x() + bar.get_width()/2., height,
-                f'{int(height)}', ha='center', va='bottom', fontsize=8)
-    
-    # 2. Average Words per Post (top-right)
-    ax2.plot(years, avg_words, marker='o', color='#4CAF50', linewidth=2)
-    ax2.set_title('Average Words per Post', pad=15, fontsize=12)
-    ax2.set_xlabel('Year', fontsize=10)
-    ax2.set_ylabel('Words', fontsize=10)
-    ax2.set_xticks(years)
-    ax2.set_xticklabels(years_str)
-    ax2.grid(True, linestyle='--', alpha=0.7)
-    for x, y in zip(years, avg_words):
-        ax2.text(x, y, f'{int(y)}', ha='center', va='bottom', fontsize=8)
-    
-    # 3. Total Words per Year (bottom-left)
-    bars3 = ax3.bar(years, total_words, color='#FF9800', alpha=0.7)
-    ax3.set_title('Total Words per Year', pad=15, fontsize=12)
-    ax3.set_xlabel('Year', fontsize=10)
-    ax3.set_ylabel('Words', fontsize=10)
-    ax3.set_xticks(years)
-    ax3.set_xticklabels(years_str)
-    ax3.grid(True, linestyle='--', alpha=0.7)
-    for bar in bars3:
-        height = bar.get_height()
-        ax3.text(bar.get_x() + bar.get_width()/2., height,
-                f'{int(height)}', ha='center', va='bottom', fontsize=8)
-    
-    # 4. Days Since Last Post (bottom-right)
-    if dates and gaps:
-        ax4.plot(dates, gaps, marker='o', color='#9C27B0', linewidth=0, markersize=4)
-        ax4.set_title('Days Since Last Post', pad=15, fontsize=12)
-        ax4.set_xlabel('Date', fontsize=10)
-        ax4.set_ylabel('Days', fontsize=10)
-        ax4.set_yscale('linear')
-        ax4.set_ylim(bottom=0, top=300)
-        ax4.yaxis.set_major_formatter(ticker.FuncFormatter(lambda y, _: f'{int(y)}'))
-        ax4.grid(True, linestyle='--', alpha=0.7)
-        ax4.tick_params(axis='x', rotation=45, labelsize=8)
-
-    # 5. Stats Table (right side - margin note style)
-    ax_stats.axis('off')
-    #ax_stats.set_title('Overall Statistics', pad=15, fontsize=10, fontweight='bold', loc='left')
-
+    ax.axis('off')
     stats_text = f"""Total Posts: {total_posts}
 Total Words: {total_words_count:,}
 Days Span: {days_span}
@@ -293,46 +297,124 @@ Avg Days Between Posts: {avg_days_between_posts:.1f}
 Avg Words per Year: {avg_words_per_year:,.0f}
 Avg Posts per Year: {avg_posts_per_year:.1f}"""
 
-    ax_stats.text(-2.05, 0.94, stats_text,
-                  transform=ax_stats.transAxes,
-                  fontsize=12,
-                  verticalalignment='center',
-                  horizontalalignment='left',
-                  family='monospace')
+    ax.text(-2.05, 0.94, stats_text,
+            transform=ax.transAxes,
+            fontsize=12,
+            verticalalignment='center',
+            horizontalalignment='left',
+            family='monospace')
+
+
+CHARTS = {
+    'posts_per_year.svg': draw_posts_per_year,
+    'avg_words_per_post.svg': draw_avg_words_per_post,
+    'total_words_per_year.svg': draw_total_words_per_year,
+    'days_since_last_post.svg': draw_days_since_last_post,
+    'days_between_posts_histogram.svg': draw_gap_histogram,
+}
+# charts in the 2x2 combined layout, in order
+COMBINED_CHARTS = ['posts_per_year.svg', 'avg_words_per_post.svg',
+                   'total_words_per_year.svg', 'days_since_last_post.svg']
+COMBINED_PLOT = 'blog_stats_combined.svg'
+PLOT_CACHE_FILE = Path('.cache/plots.json')
+
+
+def create_plot(fname, stats, gap_data):
+    """Create and save an individual plot as an SVG file."""
+    plt.style.use('default')
+    fig, ax = plt.subplots(figsize=(10, 6), dpi=300)
+    CHARTS[fname](ax, stats, gap_data, small=False)
+    fig.tight_layout()
+    fig.savefig(fname, format='svg', bbox_inches='tight')
+    plt.close(fig)
+
+
+def create_combined_plot(stats, gap_data, all_posts):
+    """Create a 2x2 combined plot with all four charts and a stats table."""
+    # Create figure with custom layout: 2x2 grid for plots, 1 narrow column for stats
+    fig = plt.figure(figsize=(18, 12), dpi=300)
+    gs = fig.add_gridspec(2, 3, width_ratios=[1, 1, 0.05], hspace=0.3, wspace=0.2)
+
+    for i, name in enumerate(COMBINED_CHARTS):
+        ax = fig.add_subplot(gs[i // 2, i % 2])
+        CHARTS[name](ax, stats, gap_data, small=True)
+
+    # Stats Table (right side - margin note style)
+    draw_overall_stats(fig.add_subplot(gs[:, 2]), stats, all_posts)
 
-    plt.savefig('blog_stats_combined.svg', format='svg', bbox_inches='tight')
-    plt.close()
+    fig.savefig(COMBINED_PLOT, format='svg', bbox_inches='tight')
+    plt.close(fig)
+
+
+def render_plot(job):
+    fname, args = job
+    if fname == COMBINED_PLOT:
+        create_combined_plot(*args)
+    else:
+        create_plot(fname, *args)
+    return fname
+
+
+def plot_inputs_hash(args):
+    # the plotting code is part of the input, changing a chart re-renders it
+    h = hashlib.sha256(Path(__file__).read_bytes())
+    h.update(json.dumps(args, default=str, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def create_plots(stats, gap_data, all_posts, individual=False):
+    """
+    Render the SVG plots in a process pool, skipping the ones whose
+    input stats did not change since the last run.
+    Returns the names of the plots which were rendered.
+    """
+    jobs = [(COMBINED_PLOT, (stats, gap_data, all_posts))]
+    if individual:
+        jobs.extend((fname, (stats, gap_data)) for fname in CHARTS)
+
+    cache = {}
+    if PLOT_CACHE_FILE.exists():
+        with PLOT_CACHE_FILE.open() as fd:
+            cache = json.load(fd)
+
+    hashes = {fname: plot_inputs_hash(args) for fname, args in jobs}
+    pending = [job for job in jobs
+               if cache.get(job[0]) != hashes[job[0]] or not Path(job[0]).exists()]
+    if not pending:
+        return []
+
+    if len(pending) == 1:
+        rendered = [render_plot(pending[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as executor:
+            rendered = list(executor.map(render_plot, pending))
+
+    cache.update({fname: hashes[fname] for fname in rendered})
+    PLOT_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with PLOT_CACHE_FILE.open('w') as fd:
+        json.dump(cache, fd, indent=1)
+    return rendered
 
 
 if __name__ == "__main__":
-    blog_directory = "blog/raw/"
-
-    stats, gap_data, all_posts = analyze_posts_with_gaps(blog_directory)
-#    if os.path.isfile('out.json'):
-#        with open('out.json', 'r') as fd:
-#            data = json.load(fd)
-#            print(len(data))
-#            stats, gap_data = data
-#    else:
-#        data = analyze_posts_with_gaps(blog_directory)
-#        with open('out.json', 'w') as fd:
-#            json.dump(data, fd)
-#        stats, gap_data = data
+    stats, gap_data, all_posts = analyze_posts_with_gaps()
 
     # Print statistics
     print("\nBlog Statistics by Year:")
-    print("-" * 65)
-    print(f"{'Year':<10} {'Posts':<10} {'Total Words':<15} {'Avg Words/Post':<15}")
-    print("-" * 65)
+    print("-" * 80)
+    print(f"{'Year':<10} {'Posts':<10} {'Total Words':<15} {'Avg Words/Post':<15} {'Code Words':<15}")
+    print("-" * 80)
     total = 0
     for year_stat in stats:
         total += year_stat['total_words']
         print(f"{year_stat['year']:<10} {year_stat['posts']:<10} "
-              f"{year_stat['total_words']:<15} {year_stat['avg_words_per_post']:<15.2f}")
+              f"{year_stat['total_words']:<15} {year_stat['avg_words_per_post']:<15.2f} "
+              f"{year_stat['code_words']:<15}")
 
     # Create and save visualizations
-    create_and_save_plots(stats, gap_data)
-    create_combined_plot(stats, gap_data, all_posts)
-    print(f"\nIndividual plots saved as SVG files")
-    print(f"Combined plot saved as 'blog_stats_combined.svg'")
+    rendered = create_plots(stats, gap_data, all_posts, individual='all' in sys.argv[1:])
+    if rendered:
+        print(f"\nPlots saved as SVG files: {', '.join(rendered)}")
+    else:
+        print("\nPlots are up to date")
     print(f"total {total}")
@@ -0,0 +1,125 @@
+"""
+Keeps the asciinema player (~580KB of JS, plus its CSS) and the casts off the
+critical path of the posts that embed recordings.
+
+At build time, every <asciinema-player> is replaced by a placeholder holding
+a poster: the image in its `poster` attribute, or else a frame of the cast
+rendered with pyte (at the `npt:` time of the poster, or the last frame).
+js/asciinema-loader.js fetches the player when a placeholder scrolls into
+view, and swaps the placeholder for the player when it is clicked.
+
+Casts are also written gzipped next to the originals (.cast.gz), which
+Caddy serves as precompressed files.
+"""
+import gzip
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import lxml.html
+import pyte
+
+import output
+
+OUT_DIR = Path('blog/html')
+CASTS_DIR = OUT_DIR / 'casts'
+LOADER_SCRIPT = '/js/asciinema-loader.js'
+PLAYER_RE = re.compile(r'<asciinema-player[^>]*\ssrc="([^"]+)"')
+# attributes of the player which are kept on the placeholder, to create the player with
+PLAYER_ATTRIBUTES = ('src', 'cols', 'rows', 'preload', 'speed', 'idle-time-limit', 'theme', 'font-size')
+
+
+def cast_file(src: str) -> Path:
+    return OUT_DIR / src.lstrip('/')
+
+
+def casts_in(markdown: str) -> list[Path]:
+    """The cast files embedded in a post, its placeholders depend on them"""
+    return [cast_file(src) for src in PLAYER_RE.findall(markdown)]
+
+
+def npt_seconds(poster: str) -> float:
+    """`npt:1:23` -> 83.0"""
+    seconds = 0.0
+    for part in poster[len('npt:'):].split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+@lru_cache
+def _render_frame(path: str, mtime_ns: int, size: int, at: Optional[float]) -> str:
+    with open(path, encoding='utf-8') as fd:
+        header = json.loads(fd.readline())
+        assert header.get('version') == 2, f'{path} is not an asciicast v2 file'
+        screen = pyte.Screen(header['width'], header['height'])
+        stream = pyte.Stream(screen)
+        for line in fd:
+            if not line.strip():
+                continue
+            time, kind, data = json.loads(line)
+            if at is not None and time > at:
+                break
+            if kind == 'o':
+                stream.feed(data)
+    return '\n'.join(line.rstrip() for line in screen.display)
+
+
+def render_frame(path: Path, at: Optional[float] = None) -> str:
+    """The screen of the cast at `path` after `at` seconds (None for the end), as text"""
+    st = path.stat()
+    return _render_frame(str(path), st.st_mtime_ns, st.st_size, at)
+
+
+def placeholder(player) -> lxml.html.HtmlElement:
+    src = player.get('src')
+    poster = player.get('poster') or ''
+    holder = lxml.html.Element('div', {'class': 'asciinema-placeholder'})
+    for attr in PLAYER_ATTRIBUTES:
+        if player.get(attr) is not None:
+            holder.set(f'data-{attr}', player.get(attr))
+    if poster and not poster.startswith(('npt:', 'data:')):
+        # an image, the player itself doesn't support those
+        holder.append(lxml.html.Element('img', {'class': 'asciinema-poster', 'src': poster, 'alt': '',
+                                                'loading': 'lazy'}))
+    else:
+        if poster:
+            holder.set('data-poster', poster)
+        at = npt_seconds(poster) if poster.startswith('npt:') else None
+        frame = lxml.html.Element('pre', {'class': 'asciinema-poster'})
+        frame.text = render_frame(cast_file(src), at)
+        holder.append(frame)
+    button = lxml.html.Element('button', {'class': 'asciinema-play', 'type': 'button',
+                                          'aria-label': 'Play recording'})
+    button.text = '▶'
+    holder.append(button)
+    return holder
+
+
+def replace_players(html) -> bool:
+    """Replaces the players in `html` with their placeholders; returns whether there were any"""
+    players = list(html.iter('asciinema-player'))
+    for player in players:
+        holder = placeholder(player)
+        parent = player.getparent()
+        # markdown wraps the player in a <p>, which can't hold a <div>
+        if parent.tag == 'p' and len(parent) == 1 and not (parent.text or '').strip() \
+                and not (player.tail or '').strip():
+            player = parent
+        holder.tail = player.tail
+        player.getparent().replace(player, holder)
+    return bool(players)
+
+
+def compress_casts() -> int:
+    """Writes a .cast.gz next to every cast, returns how many changed"""
+    written = 0
+    for cast in sorted(CASTS_DIR.glob('*.cast')):
+        compressed = cast.with_name(cast.name + '.gz')
+        if compressed.exists() and compressed.stat().st_mtime_ns >= cast.stat().st_mtime_ns:
+            continue
+        # no timestamp in the header, so the output only changes with the cast
+        data = gzip.compress(cast.read_bytes(), compresslevel=9, mtime=0)
+        written += output.write(compressed, data)
+    return written
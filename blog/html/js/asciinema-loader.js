@@ -0,0 +1,44 @@
+// Casts are replaced at build time by a placeholder with a poster (see asciinema.py).
+// The player is fetched once a placeholder scrolls into view, and replaces it when clicked.
+(() => {
+    const placeholders = document.querySelectorAll('.asciinema-placeholder');
+    if (placeholders.length === 0) {
+        return;
+    }
+    let player = null;
+
+    // the player adds its own stylesheet
+    const loadPlayer = () => {
+        player ??= new Promise((resolve, reject) => {
+            const script = document.createElement('script');
+            script.src = '/js/asciinema-player.js';
+            script.onload = resolve;
+            script.onerror = reject;
+            document.head.append(script);
+        });
+        return player;
+    };
+
+    const play = async (placeholder) => {
+        await loadPlayer();
+        const element = document.createElement('asciinema-player');
+        for (const [key, value] of Object.entries(placeholder.dataset)) {
+            // dataset keys are camelCased, the player's attributes are dashed
+            element.setAttribute(key.replace(/[A-Z]/g, (c) => `-${c.toLowerCase()}`), value);
+        }
+        element.setAttribute('autoplay', '');
+        placeholder.replaceWith(element);
+    };
+
+    const observer = new IntersectionObserver((entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) {
+            loadPlayer();
+            observer.disconnect();
+        }
+    }, {rootMargin: '200px'});
+
+    for (const placeholder of placeholders) {
+        observer.observe(placeholder);
+        placeholder.querySelector('.asciinema-play').addEventListener('click', () => play(placeholder), {once: true});
+    }
+})();
@@ -0,0 +1,14 @@
+// Large code blocks are collapsed at build time; fetch the full block when expanded.
+document.addEventListener('click', async (event) => {
+    const link = event.target.closest('a.code-expand');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    const response = await fetch(link.href);
+    if (!response.ok) {
+        window.location = link.href;
+        return;
+    }
+    link.closest('.code-collapsed').outerHTML = await response.text();
+});
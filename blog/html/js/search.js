@@ -0,0 +1,125 @@
+// Client for the sharded search index generated by search_index.py
+// Shards are only fetched for the terms being searched, and cached for the page lifetime.
+(() => {
+    const input = document.getElementById('search');
+    if (!input) {
+        return;
+    }
+    const results = document.getElementById('search-results');
+    const posts = document.getElementById('posts');
+    const shards = new Map();
+    let docs = null;
+
+    // must match STOPWORDS in search_index.py
+    const STOPWORDS = new Set(`
+a about after all also an and any are as at be because been but by can could did do does
+doing done for from had has have he her his how i if in into is it its just me more most
+my no not of on once only or other our out over she so some such than that the their them
+then there these they this those through to too under up very was we were what when where
+which while who why will with would you your`.trim().split(/\s+/));
+
+    const fetchJSON = (url) => fetch(url).then((r) => r.ok ? r.json() : {}).catch(() => ({}));
+
+    const tokenize = (text) => (text.toLowerCase().match(/[\p{L}\p{N}_]+/gu) || [])
+        .filter((t) => t.length > 1 && !STOPWORDS.has(t));
+
+    const shardKey = (term) => /^[a-z0-9_]{2}/.test(term) ? term.slice(0, 2) : '__';
+
+    const getShard = (key) => {
+        if (!shards.has(key)) {
+            shards.set(key, fetchJSON(`/search/${key}.json`));
+        }
+        return shards.get(key);
+    };
+
+    // every query term must match (as a prefix of) some indexed term
+    const search = async (query) => {
+        const terms = tokenize(query);
+        if (terms.length === 0) {
+            return null;
+        }
+        if (docs === null) {
+            docs = fetchJSON('/search/docs.json');
+        }
+        let scores = null;
+        for (const term of terms) {
+            const shard = await getShard(shardKey(term));
+            const termScores = new Map();
+            for (const [indexed, postings] of Object.entries(shard)) {
+                if (!indexed.startsWith(term)) {
+                    continue;
+                }
+                // exact matches rank above prefix matches
+                const boost = indexed === term ? 2 : 1;
+                for (const [doc, score] of postings) {
+                    termScores.set(doc, (termScores.get(doc) || 0) + score * boost);
+                }
+            }
+            if (scores === null) {
+                scores = termScores;
+            } else {
+                for (const doc of scores.keys()) {
+                    if (!termScores.has(doc)) {
+                        scores.delete(doc);
+                    } else {
+                        scores.set(doc, scores.get(doc) + termScores.get(doc));
+                    }
+                }
+            }
+        }
+        const allDocs = await docs;
+        return [...scores.entries()]
+            .sort((a, b) => b[1] - a[1])
+            .map(([doc]) => allDocs[doc])
+            .filter((doc) => doc);
+    };
+
+    const render = (found) => {
+        results.replaceChildren();
+        if (found === null) {
+            results.hidden = true;
+            posts.hidden = false;
+            return;
+        }
+        posts.hidden = true;
+        results.hidden = false;
+        if (found.length === 0) {
+            const p = document.createElement('p');
+            p.textContent = 'No posts found';
+            results.append(p);
+            return;
+        }
+        for (const doc of found) {
+            const article = document.createElement('article');
+            article.className = 'my-4 md:my-4';
+            const title = document.createElement('span');
+            title.className = 'font-semibold text-xl md:text-2xl';
+            const link = document.createElement('a');
+            link.href = doc.u;
+            link.textContent = doc.t;
+            title.append(link);
+            article.append(title);
+            if (doc.d) {
+                const desc = document.createElement('div');
+                desc.className = 'text-sm dark:text-gray-450 text-gray-600';
+                desc.textContent = doc.d;
+                article.append(desc);
+            }
+            const date = document.createElement('span');
+            date.className = 'text-sm text-gray-450';
+            date.textContent = doc.p;
+            article.append(date);
+            results.append(article);
+        }
+    };
+
+    let pending = 0;
+    input.addEventListener('input', async () => {
+        const current = ++pending;
+        const found = await search(input.value);
+        // a newer query was typed while this one was loading
+        if (current === pending) {
+            render(found);
+        }
+    });
+})();
@@ -0,0 +1,107 @@
+// Service worker generated by service_worker.py, do not edit blog/html/sw.js
+// The manifest maps every url to the hash of its content in this build:
+// `precache` urls are fetched on install, `pages` are cached once visited
+// (only the RECENT_PAGES most recently viewed). Both are served cache-first
+// and revalidated in the background; on activation, only the cached entries
+// whose hash changed since they were cached are dropped.
+const MANIFEST = {{ manifest }};
+const RECENT_PAGES = {{ recent_pages }};
+const CACHE = 'blog';
+// url -> {hash, used}, of every entry in the cache
+const META_URL = '/__sw-meta';
+
+const readMeta = async (cache) => {
+    const response = await cache.match(META_URL);
+    return response ? response.json() : {};
+};
+
+const writeMeta = (cache, meta) => cache.put(META_URL, new Response(JSON.stringify(meta)));
+
+// read-modify-write of the meta, one at a time: concurrent fetches would overwrite each other's updates
+let metaQueue = Promise.resolve();
+const updateMeta = (cache, update) => {
+    const run = metaQueue.then(async () => {
+        const meta = await readMeta(cache);
+        await update(meta);
+        await writeMeta(cache, meta);
+    });
+    metaQueue = run.catch(() => {});
+    return run;
+};
+
+const expectedHash = (url) => MANIFEST.precache[url] ?? MANIFEST.pages[url];
+
+self.addEventListener('install', (event) => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE);
+        await updateMeta(cache, (meta) => Promise.all(Object.entries(MANIFEST.precache).map(async ([url, hash]) => {
+            if (meta[url]?.hash === hash) {
+                return;
+            }
+            const response = await fetch(url, {cache: 'no-cache'});
+            if (response.ok) {
+                await cache.put(url, response);
+                meta[url] = {hash, used: Date.now()};
+            }
+        })));
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE);
+        await updateMeta(cache, async (meta) => {
+            for (const request of await cache.keys()) {
+                const url = new URL(request.url).pathname;
+                if (url === META_URL) {
+                    continue;
+                }
+                if (meta[url] === undefined || meta[url].hash !== expectedHash(url)) {
+                    await cache.delete(request);
+                    delete meta[url];
+                }
+            }
+        });
+        await self.clients.claim();
+    })());
+});
+
+const trimPages = (cache, meta) => {
+    const pages = Object.keys(meta).filter((url) => url in MANIFEST.pages);
+    pages.sort((a, b) => meta[b].used - meta[a].used);
+    return Promise.all(pages.slice(RECENT_PAGES).map((url) => {
+        delete meta[url];
+        return cache.delete(url);
+    }));
+};
+
+const revalidate = async (cache, url) => {
+    const response = await fetch(url, {cache: 'no-cache'});
+    if (response.ok && !response.redirected) {
+        await cache.put(url, response.clone());
+        await updateMeta(cache, (meta) => {
+            meta[url] = {hash: expectedHash(url), used: Date.now()};
+            return trimPages(cache, meta);
+        });
+    }
+    return response;
+};
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin || expectedHash(url.pathname) === undefined) {
+        return;
+    }
+    event.respondWith((async () => {
+        const cache = await caches.open(CACHE);
+        const cached = await cache.match(url.pathname);
+        const fresh = revalidate(cache, url.pathname);
+        if (cached) {
+            event.waitUntil(fresh.catch(() => {}));
+            return cached;
+        }
+        return fresh;
+    })());
+});
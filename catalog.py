@@ -0,0 +1,167 @@
+"""
+SQLite catalog of the metadata of every post, at .cache/catalog.sqlite3.
+
+A post is only parsed again when the hash of its POST.md changes (and only
+hashed again when its inode, size or mtime change), so queries such as
+"posts with this tag" or "posts in this series" are one indexed query
+instead of a scan of blog/raw/.
+Word counts are filled in by analysis.py, and reset when the post changes.
+
+Run directly to list the tags with their post counts (see list-tags.sh).
+"""
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from typing import Callable, Optional
+
+DB_FILE = Path('.cache/catalog.sqlite3')
+POSTS_DIR = Path('blog/raw')
+# bump when the schema or the parsing changes, the catalog is then rebuilt from scratch
+SCHEMA_VERSION = 5
+
+SCHEMA = '''
+CREATE TABLE posts (
+    dir TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    -- NULL for drafts which don't have a slug yet, they have no url
+    slug TEXT,
+    title TEXT NOT NULL,
+    description TEXT,
+    date TEXT NOT NULL,
+    draft INTEGER NOT NULL,
+    series TEXT,
+    -- json list, in the order of the front matter
+    tags TEXT NOT NULL,
+    -- json list of the slugs the post was renamed from
+    old_slugs TEXT NOT NULL,
+    -- NULL until analysis.py counts the words of this version of the post
+    stats_version INTEGER,
+    prose_words INTEGER,
+    inline_code_words INTEGER,
+    code_words INTEGER
+);
+CREATE INDEX posts_date ON posts (date, slug);
+CREATE INDEX posts_slug ON posts (slug);
+CREATE INDEX posts_series ON posts (series, date);
+CREATE TABLE post_tags (
+    dir TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (tag, dir)
+);
+CREATE INDEX post_tags_dir ON post_tags (dir);
+'''
+
+
+class Catalog:
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    @staticmethod
+    def open(path: Path = DB_FILE) -> 'Catalog':
+        path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(path)
+        db.row_factory = sqlite3.Row
+        if db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            db.executescript(f'''
+                DROP TABLE IF EXISTS posts;
+                DROP TABLE IF EXISTS post_tags;
+                {SCHEMA}
+                PRAGMA user_version = {SCHEMA_VERSION};
+            ''')
+        return Catalog(db)
+
+    def update(self, parse: Callable[[str], object]) -> int:
+        """
+        Brings the catalog up to date with blog/raw/; `parse` turns the markdown
+        of a post into its PostMetadata (without resolving the series).
+        Returns how many posts were (re-)parsed.
+        """
+        known = {row['dir']: row for row in
+                 self.db.execute('SELECT dir, content_hash, inode, size, mtime_ns FROM posts')}
+        seen = set()
+        parsed = 0
+        with self.db:
+            for post_file in POSTS_DIR.glob('*/POST.md'):
+                name = post_file.parent.name
+                seen.add(name)
+                st = post_file.stat()
+                file_id = (st.st_ino, st.st_size, st.st_mtime_ns)
+                old = known.get(name)
+                if old is not None and (old['inode'], old['size'], old['mtime_ns']) == file_id:
+                    continue
+                raw = post_file.read_bytes()
+                content_hash = hashlib.sha256(raw).hexdigest()
+                if old is not None and old['content_hash'] == content_hash:
+                    # touched, or copied around, but not modified
+                    self.db.execute('UPDATE posts SET inode = ?, size = ?, mtime_ns = ? WHERE dir = ?',
+                                    (*file_id, name))
+                    continue
+                meta = parse(raw.decode('utf-8'))
+                try:
+                    slug = meta.get_slug()
+                except ValueError:
+                    if not meta.incomplete:
+                        raise
+                    slug = None
+                # replacing the row also resets the word counts
+                self.db.execute('INSERT OR REPLACE INTO posts (dir, content_hash, inode, size, mtime_ns, slug, title, '
+                                'description, date, draft, series, tags, old_slugs) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                (name, content_hash, *file_id, slug, meta.title, meta.description,
+                                 meta.date.isoformat(), bool(meta.incomplete), meta.series, json.dumps(meta.tags),
+                                 json.dumps(meta.old_slugs)))
+                self.db.execute('DELETE FROM post_tags WHERE dir = ?', (name,))
+                self.db.executemany('INSERT OR IGNORE INTO post_tags (dir, tag) VALUES (?, ?)',
+                                    [(name, tag) for tag in meta.tags])
+                parsed += 1
+            for name in known.keys() - seen:
+                self.db.execute('DELETE FROM posts WHERE dir = ?', (name,))
+                self.db.execute('DELETE FROM post_tags WHERE dir = ?', (name,))
+        return parsed
+
+    def posts(self, drafts=False, tag: Optional[str] = None, series: Optional[str] = None) -> list[sqlite3.Row]:
+        """
+        Posts sorted by (date, slug), optionally only those with `tag` or in `series`;
+        drafts without a slug are never listed, they have no url
+        """
+        query = 'SELECT posts.* FROM posts'
+        where: list[str] = ['posts.slug IS NOT NULL']
+        params: list[str] = []
+        if tag is not None:
+            query += ' JOIN post_tags USING (dir)'
+            where.append('post_tags.tag = ?')
+            params.append(tag)
+        if series is not None:
+            where.append('posts.series = ?')
+            params.append(series)
+        if not drafts:
+            where.append('NOT posts.draft')
+        query += ' WHERE ' + ' AND '.join(where)
+        return self.db.execute(query + ' ORDER BY posts.date, posts.slug', params).fetchall()
+
+    def tags(self, drafts=False) -> list[tuple[str, int]]:
+        """Every tag with its post count, least used first"""
+        query = 'SELECT tag, count(*) AS posts FROM post_tags JOIN posts USING (dir)'
+        if not drafts:
+            query += ' WHERE NOT posts.draft'
+        return [(row['tag'], row['posts'])
+                for row in self.db.execute(query + ' GROUP BY tag ORDER BY posts, tag')]
+
+    def series(self) -> list[str]:
+        return [row['series'] for row in
+                self.db.execute('SELECT DISTINCT series FROM posts WHERE series IS NOT NULL ORDER BY series')]
+
+    def set_stats(self, name: str, version: int, prose_words: int, inline_code_words: int, code_words: int):
+        with self.db:
+            self.db.execute('UPDATE posts SET stats_version = ?, prose_words = ?, inline_code_words = ?, '
+                            'code_words = ? WHERE dir = ?',
+                            (version, prose_words, inline_code_words, code_words, name))
+
+
+if __name__ == '__main__':
+    from generate import get_catalog
+    for tag, count in get_catalog().tags(drafts=True):
+        print(f'{count:7} {tag}')
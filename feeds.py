@@ -0,0 +1,159 @@
+"""
+Writes the RSS and Atom feeds, with the full content of the posts.
+
+Feeds are written as a stream of strings, straight from the entries; the
+content of an entry is the post-processed article cached by generate.py, so
+posts are not rendered again for the feeds. The output only depends on the
+entries in the feed (no build timestamp), so a feed whose posts didn't change
+is byte-identical and is not written again.
+
+The `updated` time of an entry is when its title, description or content
+last changed: a hash of them is kept per entry in .cache/feeds.json, and when
+it changes the entry is updated at the time of the build. An entry seen for
+the first time is updated when it was published.
+"""
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from email.utils import format_datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, Optional
+from xml.sax.saxutils import escape, quoteattr
+from zoneinfo import ZoneInfo
+
+TITLE = 'Mumbling about computers'
+DESCRIPTION = 'Exploring software development, embedded systems, and homelab projects.'
+AUTHOR_NAME = 'David Ventura'
+AUTHOR_EMAIL = 'hello@davidv.dev'
+LOGO = 'https://blog.davidv.dev/images/logo.svg'
+# posts are dated, not timestamped, they are published at midnight here
+TIMEZONE = ZoneInfo('Europe/Amsterdam')
+# newest posts in each feed
+MAX_ENTRIES = 20
+CACHE_FILE = Path('.cache/feeds.json')
+# bump when the hashed fields change
+VERSION = 1
+
+
+@dataclass
+class FeedEntry:
+    # the feeds started with the urls without a trailing slash as ids,
+    # changing them would duplicate every post in feed readers
+    id: str
+    url: str
+    title: str
+    description: Optional[str]
+    published: datetime
+    # HTML, None to only have the description
+    content: Optional[str]
+    # when the entry last changed, see `updated`
+    updated: Optional[datetime] = None
+
+    def content_hash(self) -> str:
+        fields = [self.title, self.description or '', self.content or '']
+        return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def load_state() -> dict[str, dict]:
+    """Entry id -> {hash, updated}; loaded once, shared by every feed of the build"""
+    if CACHE_FILE.exists():
+        with CACHE_FILE.open() as fd:
+            data = json.load(fd)
+        if data.get('version') == VERSION:
+            return data['entries']
+    return {}
+
+
+def updated(entry: FeedEntry, now: datetime) -> datetime:
+    """When `entry` last changed, `now` if it changed since the last build"""
+    state = load_state()
+    content_hash = entry.content_hash()
+    old = state.get(entry.id)
+    if old is None:
+        when = entry.published
+    elif old['hash'] != content_hash:
+        when = now
+    else:
+        when = datetime.fromisoformat(old['updated'])
+    state[entry.id] = {'hash': content_hash, 'updated': when.isoformat()}
+    return when
+
+
+def save_state():
+    CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with CACHE_FILE.open('w') as fd:
+        json.dump({'version': VERSION, 'entries': load_state()}, fd, sort_keys=True)
+
+
+@dataclass
+class Feed:
+    title: str
+    # the page the feed is about, and the url of the feed itself
+    url: str
+    feed_url: str
+    # newest first
+    entries: list[FeedEntry]
+
+
+def last_updated(feed: Feed) -> datetime:
+    return max(entry.updated or entry.published for entry in feed.entries)
+
+
+def rss(feed: Feed) -> Iterator[str]:
+    yield "<?xml version='1.0' encoding='UTF-8'?>\n"
+    yield ('<rss xmlns:atom="http://www.w3.org/2005/Atom" '
+           'xmlns:content="http://purl.org/rss/1.0/modules/content/" version="2.0">\n')
+    yield '  <channel>\n'
+    yield f'    <title>{escape(feed.title)}</title>\n'
+    yield f'    <link>{escape(feed.url)}</link>\n'
+    yield f'    <description>{escape(DESCRIPTION)}</description>\n'
+    yield f'    <atom:link href={quoteattr(feed.feed_url)} rel="self"/>\n'
+    yield f'    <image>\n      <url>{LOGO}</url>\n      <title>{escape(feed.title)}</title>\n'
+    yield f'      <link>{escape(feed.url)}</link>\n    </image>\n'
+    yield '    <language>en</language>\n'
+    if feed.entries:
+        yield f'    <lastBuildDate>{format_datetime(last_updated(feed))}</lastBuildDate>\n'
+    for entry in feed.entries:
+        yield '    <item>\n'
+        yield f'      <title>{escape(entry.title)}</title>\n'
+        yield f'      <link>{escape(entry.url)}</link>\n'
+        if entry.description:
+            yield f'      <description>{escape(entry.description)}</description>\n'
+        if entry.content is not None:
+            yield f'      <content:encoded>{escape(entry.content)}</content:encoded>\n'
+        yield f'      <author>{AUTHOR_EMAIL} ({AUTHOR_NAME})</author>\n'
+        yield f'      <guid isPermaLink="false">{escape(entry.id)}</guid>\n'
+        yield f'      <pubDate>{format_datetime(entry.published)}</pubDate>\n'
+        yield '    </item>\n'
+    yield '  </channel>\n'
+    yield '</rss>\n'
+
+
+def atom(feed: Feed) -> Iterator[str]:
+    yield "<?xml version='1.0' encoding='UTF-8'?>\n"
+    yield '<feed xmlns="http://www.w3.org/2005/Atom" xml:lang="en">\n'
+    yield f'  <id>{escape(feed.url)}</id>\n'
+    yield f'  <title>{escape(feed.title)}</title>\n'
+    yield f'  <subtitle>{escape(DESCRIPTION)}</subtitle>\n'
+    yield f'  <link href={quoteattr(feed.url)} rel="alternate"/>\n'
+    yield f'  <link href={quoteattr(feed.feed_url)} rel="self"/>\n'
+    yield f'  <logo>{LOGO}</logo>\n'
+    yield f'  <author>\n    <name>{AUTHOR_NAME}</name>\n    <email>{AUTHOR_EMAIL}</email>\n  </author>\n'
+    if feed.entries:
+        yield f'  <updated>{last_updated(feed).isoformat()}</updated>\n'
+    for entry in feed.entries:
+        yield '  <entry>\n'
+        yield f'    <id>{escape(entry.id)}</id>\n'
+        yield f'    <title>{escape(entry.title)}</title>\n'
+        yield f'    <link href={quoteattr(entry.url)} rel="alternate"/>\n'
+        yield f'    <published>{entry.published.isoformat()}</published>\n'
+        yield f'    <updated>{(entry.updated or entry.published).isoformat()}</updated>\n'
+        if entry.description:
+            yield f'    <summary>{escape(entry.description)}</summary>\n'
+        if entry.content is not None:
+            yield f'    <content type="html">{escape(entry.content)}</content>\n'
+        yield '  </entry>\n'
+    yield '</feed>\n'
@@ -1,41 +1,72 @@
 #!/usr/bin/env python3
 import time
-import shutil
+import hashlib
+import io
+import shlex
 import subprocess
-import glob
 import os
 import re
 import sys
 import json
 import xml.etree.ElementTree as ET
 
-import pytz
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, date
 from functools import lru_cache
 from pathlib import Path
-from typing import Optional, List
+from typing import Callable, Iterable, Optional, List
 
-from bs4 import BeautifulSoup
-from feedgen.feed import FeedGenerator
+import lxml.html
 from jinja2 import Template
-from markdown2 import Markdown
 import yaml
 
 sys.path.insert(0, "/home/david/git/blog")
+import asciinema
+import catalog
 import explode_drawio
+import feeds
+import markdown_engines
+import output
+import page_audit
+import preload
+import redirects
+import related_posts
+import search_index
+import service_worker
+import sitemap
 
 BLOG_URL = 'https://blog.davidv.dev/'
+SERIES_FILE = Path('blog/series.yml')
 BODY_TEMPLATE_FILE = 'blog/template/body.html'
 BODY_TEMPLATE = Template(open(BODY_TEMPLATE_FILE, 'r').read())
 INDEX_TEMPLATE = Template(open('blog/template/index.html', 'r').read())
+CARD_TEMPLATE = Template(open('blog/template/card.html', 'r').read())
+SERIES_TEMPLATE = Template(open('blog/template/series.html', 'r').read())
+SERIES_ITEM_TEMPLATE = Template('<li><a href="{{ url }}">{{ title }}</a></li>')
+SERIES_CURRENT_ITEM_TEMPLATE = Template('<li class="series-current-article">{{ title }} (this article)</li>')
+FRAGMENT_CACHE_DIR = Path('.cache/fragments')
+MARKDOWN_ENGINE = os.environ.get('MARKDOWN_ENGINE', 'markdown2')
+# when feed entries which changed in this build were updated
+BUILD_TIME = datetime.now(feeds.TIMEZONE).replace(microsecond=0)
 DEBUG = True
+POSTS_PER_PAGE = 20
+# code blocks with at least this many lines only ship a preview inline,
+# the full block is fetched when expanded
+LARGE_CODE_BLOCK_LINES = 60
+COLLAPSED_PREVIEW_LINES = 25
 valid_title_chars = re.compile(r'[^a-zA-Z0-9._-]')
-EMBED_FILE_RE = re.compile(r'{embed-file (?P<fname>[^}]+)}')
-EMBED_MERMAID_RE = re.compile(r'{embed-mermaid (?P<fname>[^}]+)}')
-TOOLTIP_RE = re.compile(r'{\^(?P<hint>[^|]+)[|](?P<content>[^}]+)}')
-md = Markdown(extras=["fenced-code-blocks", "cuddled-lists", "footnotes", "metadata", "tables", "header-ids", "strike"])
+# {^hint|content} tooltips, or {name argument} directives; see `preprocess`
+DIRECTIVE_RE = re.compile(r'{(?:(?P<tooltip>\^)|(?P<name>[a-z][a-z0-9-]*) )(?P<arg>[^}]+)}')
+# region markers are comments on their own line: `# region: NAME`, `// #region NAME`, `-- endregion`..
+REGION_MARKER = r'^\s*(?:#|//|--|;+|<!--|/\*)\s*#?\s*'
+REGION_START_RE = re.compile(REGION_MARKER + r'region\b[: ]?\s*(?P<name>[\w-]+)')
+REGION_END_RE = re.compile(REGION_MARKER + r'endregion\b')
+
+
+md = markdown_engines.get_engine(MARKDOWN_ENGINE)
+# the code which produces the post-processed article, besides this file
+FRAGMENT_CODE = [markdown_engines.__file__, asciinema.__file__]
 
 @dataclass
 class BlogPosting:
@@ -66,21 +97,64 @@ class SeriesMetadata:
     posts: list["PostMetadata"]
 
     @staticmethod
-    @lru_cache
-    def from_name(name: str) -> 'SeriesMetadata':
-        path = Path('blog/series.yml')
-        with path.open() as fd:
-            data = yaml.load(fd, Loader=yaml.CLoader)
+    def for_post(meta: 'PostMetadata') -> 'SeriesMetadata':
+        """The series `meta` declares in its front matter, which must also list it"""
+        index = series_index()
+        name = meta.series.strip()
+        series = index.by_name.get(name)
+        if series is None:
+            raise ValueError(f'"{meta.title}" is part of series "{name}", which is not defined in {SERIES_FILE}')
+        if index.by_slug.get(meta.get_slug()) is not series:
+            raise ValueError(f'"{meta.title}" is part of series "{name}", but is not listed in it in {SERIES_FILE}')
+        return series
+
+
+@dataclass
+class SeriesIndex:
+    # series name -> series, with its posts in reading order
+    by_name: dict[str, SeriesMetadata]
+    # post slug -> its series
+    by_slug: dict[str, SeriesMetadata]
+
+
+@lru_cache
+def _load_series_index(mtime_ns: int, size: int) -> SeriesIndex:
+    with SERIES_FILE.open() as fd:
+        data = yaml.load(fd, Loader=yaml.CLoader) or []
+    by_name: dict[str, SeriesMetadata] = {}
+    by_slug: dict[str, SeriesMetadata] = {}
+    for entry in data:
+        name = str(entry['name']).strip()
+        if name in by_name:
+            raise ValueError(f'{SERIES_FILE}: series "{name}" is defined twice')
         posts = []
-        for series in data:
-            if series['name'].strip() != name.strip():
-                continue
-            for post in series['posts']:
-                posts.append(PostMetadata.from_path(f"blog/raw/{post}/POST.md", False))
-            break
-        assert posts, series
+        for post in entry.get('posts') or []:
+            post = str(post).strip()
+            post_file = Path('blog/raw') / post / 'POST.md'
+            if not post_file.exists():
+                raise ValueError(f'{SERIES_FILE}: series "{name}" lists "{post}", which is not a post in blog/raw/')
+            meta = PostMetadata.from_path(post_file, with_series=False)
+            declared = (meta.series or '').strip()
+            if declared != name:
+                raise ValueError(f'{SERIES_FILE}: series "{name}" lists "{post}", '
+                                 f'but its front matter has "series: {declared}"')
+            if meta.get_slug() in by_slug:
+                raise ValueError(f'{SERIES_FILE}: "{post}" is listed in series '
+                                 f'"{by_slug[meta.get_slug()].name}" and "{name}"')
+            posts.append(meta)
+        if not posts:
+            raise ValueError(f'{SERIES_FILE}: series "{name}" has no posts')
+        series = SeriesMetadata(name, posts)
+        by_name[name] = series
+        by_slug.update((p.get_slug(), series) for p in posts)
+    return SeriesIndex(by_name, by_slug)
+
+
+def series_index() -> SeriesIndex:
+    """Every series in series.yml, loaded once and validated; reloaded if the file changes"""
+    st = SERIES_FILE.stat()
+    return _load_series_index(st.st_mtime_ns, st.st_size)
 
-        return SeriesMetadata(name, posts)
 
 @dataclass
 class PostMetadata:
@@ -91,6 +165,8 @@ class PostMetadata:
     slug: Optional[str] = None
     incomplete: bool = False
     series: Optional[str] = None
+    # slugs the post was published under before being renamed
+    old_slugs: List[str] = field(default_factory=list)
 
     def get_title(self):
         title = self.title
@@ -110,15 +186,20 @@ class PostMetadata:
         if not self.slug and self.date.year >= 2024:
             raise ValueError(f"New posts must have slugs: {self.title} does not have it")
 
+        return self.title_slug
+
+    @property
+    def title_slug(self) -> str:
+        """The slug derived from the title, which posts without a slug are published under"""
         tmp_title = self.title.replace(' ', '-').replace('"', '').replace("'", "").lower().strip('-')
-        slug = valid_title_chars.sub('', tmp_title).strip('-')
-        return slug
+        return valid_title_chars.sub('', tmp_title).strip('-')
 
     @staticmethod
-    def _parse_meta(text: str) -> dict[str, str]:
+    def _parse_meta(lines: Iterable[str]) -> dict[str, str]:
+        """Parses the front matter; `lines` is not consumed past its closing `---`"""
         started = False
         meta = {}
-        for line in text.splitlines():
+        for line in lines:
             line = line.strip()
             if line.startswith('#'): continue
             if line != '---':
@@ -133,24 +214,39 @@ class PostMetadata:
                 break
         return meta
     @staticmethod
-    def from_text(text: str) -> 'PostMetadata':
-        return PostMetadata.from_dict(PostMetadata._parse_meta(text))
+    def from_text(text: str, with_series=True) -> 'PostMetadata':
+        return PostMetadata.from_dict(PostMetadata._parse_meta(io.StringIO(text)), with_series)
 
     @staticmethod
-    @lru_cache
     def from_path(fname, with_series=True) -> 'PostMetadata':
-        with open(fname, 'r') as fd:
-            return PostMetadata.from_dict(PostMetadata._parse_meta(fd.read()), with_series)
+        return PostMetadata.from_dict(read_front_matter(fname), with_series)
 
     @staticmethod
     def from_dict(d, with_series=True) -> 'PostMetadata':
         date = datetime.strptime(d['date'], "%Y-%m-%d").date()
         tags = [t.strip() for t in d['tags'].split(',') if t]
-        data = {**d, 'date': date, 'tags': tags} 
+        old_slugs = [s.strip() for s in d.get('old_slugs', '').split(',') if s.strip()]
+        data = {**d, 'date': date, 'tags': tags, 'old_slugs': old_slugs}
         data.pop('started', None)
-        if with_series and data.get('series'):
-            data['series'] = SeriesMetadata.from_name(data['series'].strip())
-        return PostMetadata(**data)
+        meta = PostMetadata(**data)
+        if with_series and meta.series:
+            meta.series = SeriesMetadata.for_post(meta)
+        return meta
+
+    @staticmethod
+    def from_row(row, with_series=True) -> 'PostMetadata':
+        """From a row of the metadata catalog"""
+        meta = PostMetadata(title=row['title'],
+                            tags=json.loads(row['tags']),
+                            description=row['description'],
+                            date=date.fromisoformat(row['date']),
+                            slug=row['slug'],
+                            incomplete=bool(row['draft']),
+                            series=row['series'],
+                            old_slugs=json.loads(row['old_slugs']))
+        if with_series and meta.series:
+            meta.series = SeriesMetadata.for_post(meta)
+        return meta
 
     @property
     def as_schema_posting(self) -> BlogPosting:
@@ -160,65 +256,238 @@ class PostMetadata:
     def full_url(self) -> str:
         return f'{BLOG_URL}posts/{self.get_slug()}/'
 
+@lru_cache
+def _read_front_matter(path: str, inode: int, mtime_ns: int, size: int) -> dict[str, str]:
+    with open(path, encoding='utf-8') as fd:
+        return PostMetadata._parse_meta(fd)
+
+
+def read_front_matter(path) -> dict[str, str]:
+    """Reads only the front matter of the post at `path`; memoized until the file changes"""
+    st = os.stat(path)
+    return _read_front_matter(str(path), st.st_ino, st.st_mtime_ns, st.st_size)
+
+
 def debug(*msg):
     if DEBUG:
         print(*msg, flush=True)
 
+@lru_cache
+def get_catalog() -> catalog.Catalog:
+    """The metadata catalog, brought up to date once per run"""
+    c = catalog.Catalog.open()
+    c.update(lambda text: PostMetadata.from_text(text, with_series=False))
+    return c
+
+
+def get_posts(**filters) -> List[PostMetadata]:
+    """Posts from the catalog, oldest first; drafts are only included in dev mode"""
+    return [PostMetadata.from_row(row) for row in get_catalog().posts(drafts=DEVMODE, **filters)]
+
+
 @lru_cache
 def convert(text):
     return md.convert(text)
 
-def populate_tooltips(text):
-    return TOOLTIP_RE.sub(r'<span data-tooltip="\2">\1</span>', text)
-
-def files_to_embed(relpath, text):
-    ret = []
-    for match in EMBED_FILE_RE.finditer(text):
-        fname = match.group('fname')
-        ret.append(os.path.join(relpath, fname))
-    return ret
-
-def embed_mermaid(relpath, text, r: PostMetadata):
-    match_substr = None
-    for match in EMBED_MERMAID_RE.finditer(text):
-        fname = match.group('fname')
-        bname = os.path.basename(fname)
-        full_fname = os.path.join(relpath, fname)
-        bdir = f'blog/html/images/{r.get_slug()}'
-        os.makedirs(bdir, exist_ok=True)
-        new_fname = f'{bdir}/{bname}.svg'
-        if os.path.isfile(new_fname) and newer(new_fname, [full_fname, 'mermaid.css']):
-            # do not regenerate the same files if the sources were 
-            # not modified
-            pass
+@dataclass
+class PreprocessContext:
+    post_dir: Path
+    meta: PostMetadata
+    # files the rendered post depends on, for the staleness check
+    dependencies: List[Path] = field(default_factory=list)
+
+
+Directive = Callable[[PreprocessContext, str], Optional[str]]
+DIRECTIVES: dict[str, Directive] = {}
+
+
+def directive(name: str):
+    """
+    Registers a handler for `{name argument}` in the markdown source.
+    The handler returns the replacement text, or None to leave the directive untouched.
+    """
+    def register(fn: Directive) -> Directive:
+        DIRECTIVES[name] = fn
+        return fn
+    return register
+
+
+def preprocess(post_dir: Path, text: str, meta: PostMetadata, directives: dict[str, Directive] = DIRECTIVES):
+    """
+    Expands every directive in a single pass over the markdown source.
+    Replacements are not scanned again, so embedded files are inserted verbatim.
+    Returns the expanded text and the files it depends on.
+    """
+    ctx = PreprocessContext(post_dir, meta)
+    out = []
+    pos = 0
+    for match in DIRECTIVE_RE.finditer(text):
+        name = '^' if match.group('tooltip') else match.group('name')
+        handler = directives.get(name)
+        if handler is None:
+            continue
+        replacement = handler(ctx, match.group('arg'))
+        if replacement is None:
+            continue
+        out.append(text[pos:match.start()])
+        out.append(replacement)
+        pos = match.end()
+    out.append(text[pos:])
+    return ''.join(out), ctx.dependencies
+
+
+@directive('^')
+def tooltip(ctx: PreprocessContext, arg: str) -> Optional[str]:
+    # {^hint|content}
+    hint, sep, content = arg.partition('|')
+    if not sep or not hint or not content:
+        return None
+    return f'<span data-tooltip="{content}">{hint}</span>'
+
+
+@directive('embed-mermaid')
+def embed_mermaid(ctx: PreprocessContext, fname: str) -> str:
+    bname = os.path.basename(fname)
+    full_fname = os.path.join(ctx.post_dir, fname)
+    ctx.dependencies.append(Path(full_fname))
+    slug = ctx.meta.get_slug()
+    bdir = f'blog/html/images/{slug}'
+    os.makedirs(bdir, exist_ok=True)
+    new_fname = f'{bdir}/{bname}.svg'
+    if os.path.isfile(new_fname) and newer(new_fname, [full_fname, 'mermaid.css']):
+        # do not regenerate the same files if the sources were 
+        # not modified
+        pass
+    else:
+        command = ['./node_modules/.bin/mmdc',
+                   '-p', '.puppeteerrc.json',
+                   '-i', full_fname,
+                   '-o', new_fname,
+                   '-b', 'white',
+                   '--cssFile', 'mermaid.css']
+        print(' '.join(command))
+        subprocess.run(command)
+        with open(new_fname) as fd:
+            data = fd.read()
+            data = inject_styles_into_svg(data, get_style_for_mermaid())
+        with open(new_fname, 'wb') as fd:
+            fd.write(data)
+
+    return f'![](/images/{slug}/{bname}.svg)'
+
+
+@lru_cache(maxsize=None)
+def _read_file(path: str, mtime_ns: int, size: int) -> tuple[str, str]:
+    with open(path, 'r') as fd:
+        content = fd.read()
+    return hashlib.sha256(content.encode()).hexdigest(), content
+
+
+def read_file(path: Path) -> tuple[str, str]:
+    """
+    Returns (content hash, content) of a file; files are only read again once they change,
+    so a file embedded by multiple posts is read once.
+    """
+    st = path.stat()
+    return _read_file(str(path.resolve()), st.st_mtime_ns, st.st_size)
+
+
+def _symbol_end(lines: list[str], start: int) -> int:
+    """
+    Finds where the block starting at `start` ends: the first non-blank line indented
+    at most as much as the first one. A closing bracket at that level is part of the block.
+    """
+    indent = len(lines[start]) - len(lines[start].lstrip())
+    for i in range(start + 1, len(lines)):
+        stripped = lines[i].lstrip()
+        if not stripped:
+            continue
+        if len(lines[i]) - len(stripped) <= indent:
+            return i + 1 if stripped[0] in ')]}' else i
+    return len(lines)
+
+
+@lru_cache(maxsize=None)
+def select_fragment(content_hash: str, content: str, options: tuple[tuple[str, str], ...]) -> str:
+    """
+    Selects part of an embedded file, with any of
+    - lines=A-B: 1-based, inclusive line range; either end may be omitted
+    - lines=N: only line N
+    - start=REGEX: from the first line matching REGEX, until the end of its block
+      (by indentation) or until the first line matching end=REGEX
+    - region=NAME: the lines between `region NAME` and `endregion` comments, eg `# region: NAME`;
+      the markers of nested regions are left out
+    """
+    opts = dict(options)
+    unknown = set(opts) - {'lines', 'start', 'end', 'region'}
+    if unknown:
+        raise ValueError(f"Unknown embed-file options {unknown}")
+    lines = content.splitlines(keepends=True)
+
+    if 'lines' in opts:
+        first, dash, last = opts['lines'].partition('-')
+        if not dash:
+            last = first
+        lines = lines[int(first or 1) - 1:int(last) if last else None]
+
+    if 'region' in opts:
+        depth = 0
+        selected = None
+        for i, line in enumerate(lines):
+            match = REGION_START_RE.search(line)
+            if match and not REGION_END_RE.search(line):
+                if selected is not None:
+                    depth += 1
+                elif match.group('name') == opts['region']:
+                    selected = i + 1
+            elif REGION_END_RE.search(line) and selected is not None:
+                if depth == 0:
+                    lines = [line for line in lines[selected:i]
+                             if not REGION_START_RE.search(line) and not REGION_END_RE.search(line)]
+                    break
+                depth -= 1
         else:
-            command = ['./node_modules/.bin/mmdc',
-                       '-p', '.puppeteerrc.json',
-                       '-i', full_fname,
-                       '-o', new_fname,
-                       '-b', 'white',
-                       '--cssFile', 'mermaid.css']
-            print(' '.join(command))
-            subprocess.run(command)
-            with open(new_fname) as fd:
-                data = fd.read()
-                data = inject_styles_into_svg(data, get_style_for_mermaid())
-            with open(new_fname, 'wb') as fd:
-                fd.write(data)
-
-        match_substr = match.group(0)
-        text = text.replace(match_substr, f'![](/images/{r.get_slug()}/{bname}.svg)')
-    return text
-
-def embed_files(relpath, text):
-    match_substr = None
-    for match in EMBED_FILE_RE.finditer(text):
-        fname = match.group('fname')
-        with open(os.path.join(relpath, fname), 'r') as fd:
-            fcontent = fd.read()
-        match_substr = match.group(0)
-        text = text.replace(match_substr, fcontent)
-    return text
+            raise ValueError(f"Region '{opts['region']}' not found or not closed")
+
+    if 'start' in opts:
+        start_re = re.compile(opts['start'])
+        start = next((i for i, line in enumerate(lines) if start_re.search(line)), None)
+        if start is None:
+            raise ValueError(f"No line matches start={opts['start']}")
+        if 'end' in opts:
+            end_re = re.compile(opts['end'])
+            end = next((i + 1 for i in range(start + 1, len(lines)) if end_re.search(lines[i])), None)
+            if end is None:
+                raise ValueError(f"No line matches end={opts['end']} after start={opts['start']}")
+        else:
+            end = _symbol_end(lines, start)
+        lines = lines[start:end]
+
+    if not ''.join(lines).strip():
+        selector = ' '.join(f'{k}={v}' for k, v in options)
+        raise ValueError(f"{selector} selects no lines")
+    return ''.join(lines).rstrip('\n')
+
+
+@directive('embed-file')
+def embed_file(ctx: PreprocessContext, arg: str) -> str:
+    """
+    {embed-file path [lines=A-B] [start=REGEX [end=REGEX]] [region=NAME]}
+    Values may be quoted; backslashes are kept as-is for regexes.
+    """
+    lexer = shlex.shlex(arg, posix=True)
+    lexer.whitespace_split = True
+    lexer.escape = ''
+    fname, *options = list(lexer)
+    path = ctx.post_dir / fname
+    ctx.dependencies.append(path)
+    content_hash, content = read_file(path)
+    if not options:
+        return content
+    try:
+        return select_fragment(content_hash, content, tuple(o.partition('=')[::2] for o in options))
+    except ValueError as e:
+        raise ValueError(f"Bad {{embed-file {arg}}} in {ctx.post_dir}: {e}") from e
 
 def generate_header(metadata: PostMetadata):
     title = metadata.get_title()
@@ -226,7 +495,41 @@ def generate_header(metadata: PostMetadata):
     return template.render(title=title)
 
 
-def generate_post(header: str, body: str, meta: PostMetadata):
+@lru_cache(maxsize=None)
+def render_card(title: str, relative_url: str, description: str, date: date, tags: tuple[str, ...]) -> str:
+    # keyed by the card contents, so every card is rendered once per build
+    # and shared between the index, tag, archive and series pages
+    return CARD_TEMPLATE.render(title=title, relative_url=relative_url, description=description, date=date, tags=tags)
+
+
+def post_card(item: PostMetadata) -> str:
+    return render_card(item.get_title(), item.relative_url, item.description, item.date, tuple(item.tags))
+
+
+@lru_cache(maxsize=None)
+def render_series_fragments(name: str, posts: tuple[tuple[str, str, str], ...]):
+    """
+    Renders the series box once per series: the surrounding markup and, for every post,
+    both its entry as a link and as the current article.
+    `posts` is a tuple of (slug, title, relative url).
+    """
+    head, tail = SERIES_TEMPLATE.render(name=name, items='\0').split('\0')
+    items = tuple((slug,
+                   SERIES_ITEM_TEMPLATE.render(title=title, url=url),
+                   SERIES_CURRENT_ITEM_TEMPLATE.render(title=title))
+                  for slug, title, url in posts)
+    return head, tail, items
+
+
+def series_box(series: SeriesMetadata, current: PostMetadata) -> str:
+    posts = tuple((p.get_slug(), p.title, p.relative_url) for p in series.posts)
+    head, tail, items = render_series_fragments(series.name, posts)
+    current_slug = current.get_slug()
+    return head + '\n'.join(current_item if slug == current_slug else item
+                             for slug, item, current_item in items) + tail
+
+
+def generate_post(header: str, body: str, meta: PostMetadata, related: list[PostMetadata]):
     rendered = BODY_TEMPLATE.render(header=header,
             post=body,
             title=meta.get_title(),
@@ -238,7 +541,9 @@ def generate_post(header: str, body: str, meta: PostMetadata):
             base_url=BLOG_URL,
             structured_metadata=json.dumps(meta.as_schema_posting.as_dict()),
             devmode=DEVMODE,
-            series=meta.series)
+            series_box=series_box(meta.series, meta) if meta.series else None,
+            related=related,
+            scripts=page_scripts(body))
     assert rendered is not None
     return rendered
 
@@ -429,7 +734,7 @@ def inject_styles_into_svg(svg: bytes, style: str) -> bytes:
     return ET.tostring(root, encoding='unicode', method='xml').encode()
 
 def copy_post_md(dst_assets_dir: Path, post_dir: Path):
-    shutil.copyfile(post_dir / "POST.md", dst_assets_dir / "POST.md")
+    output.copy(post_dir / "POST.md", dst_assets_dir / "POST.md")
 
 def build_relative_assets(post_dir: Path):
     assets_dir = post_dir / "assets"
@@ -450,8 +755,8 @@ def build_relative_assets(post_dir: Path):
 
 def copy_relative_assets(html, assets_dir, post_dir):
     # Images
-    for img in html.find_all('img'):
-        src = img.attrs['src']
+    for img in html.iter('img'):
+        src = img.attrib['src']
         if src.startswith('/') or src.startswith('http'):
             continue
         og_file = post_dir / src
@@ -461,38 +766,47 @@ def copy_relative_assets(html, assets_dir, post_dir):
                 data = fd.read()
             if og_file.suffix == ".svg":
                 data = inject_styles_into_svg(data, get_style_for_diagrams())
-            with (assets_dir / og_file.name).open('wb') as fd:
-                fd.write(data)
+            output.write(assets_dir / og_file.name, data)
         else:
             print(f"Relative-referenced file {src} does not exist")
 
     # Videos
-    for source in html.find_all('source'):
-        src = source.attrs.get('src') or source.attrs.get('srcset')
+    for source in html.iter('source'):
+        src = source.get('src') or source.get('srcset')
         assert src is not None
         if src.startswith('/') or src.startswith('http'):
             continue
         og_file = post_dir / src
         if og_file.exists():
-            shutil.copyfile(og_file, assets_dir / og_file.name)
+            output.copy(og_file, assets_dir / og_file.name)
         else:
             print(f"Relative-referenced file {src} does not exist")
 
     # Anchors
-    for source in html.find_all('a'):
-        href = source.attrs.get('href')
+    for source in html.iter('a'):
+        href = source.get('href')
         assert href is not None
         if href.startswith('/') or href.startswith('http') or href.strip() == "":
             continue
         og_file = post_dir / href
         if og_file.exists():
-            shutil.copyfile(og_file, assets_dir / og_file.name)
+            output.copy(og_file, assets_dir / og_file.name)
         elif '#' not in href and 'mailto:' not in href:
             print(f"Relative-referenced file '{href}' does not exist")
 
 def main(filter_name: Optional[str]):
     this_script = __file__
     _all_time_start = time.time()
+    search = search_index.SearchIndex.load()
+    indexed_slugs: set[str] = set()
+
+    published: dict[str, tuple[PostMetadata, str]] = {}
+    for row in get_catalog().posts():
+        text = (catalog.POSTS_DIR / row['dir'] / 'POST.md').read_text(encoding='utf-8')
+        published[row['slug']] = (PostMetadata.from_row(row), text)
+    related = related_posts.RelatedPosts.load()
+    related.update(published)
+
     for post_dir in Path("blog/raw/").iterdir():
         _time_start = time.time()
         if not post_dir.is_dir():
@@ -517,14 +831,7 @@ def main(filter_name: Optional[str]):
             debug('Incomplete - skipping')
             continue
 
-        md_str = embed_files(post_dir, md_str)
-        md_str = embed_mermaid(post_dir, md_str, r)
-        md_str = populate_tooltips(md_str)
-        _files_to_embed = files_to_embed(post_dir, md_str)
-        # convert pass runs after modification of source markdown
-        # so we need to convert it again (once for metadata), if any of the above
-        # modify the text
-        body = convert(md_str)
+        md_str, _files_to_embed = preprocess(post_dir, md_str, r)
 
         header = generate_header(r)
 
@@ -538,150 +845,267 @@ def main(filter_name: Optional[str]):
         raw_assets_dir = post_dir / "assets"
         if raw_assets_dir.exists():
             _files_to_embed.extend(raw_assets_dir.glob("*.drawio"))
-
-        if os.path.isfile(html_fname):
-            _static = [post_file, this_script, BODY_TEMPLATE_FILE] + _files_to_embed
-            if newer(html_fname, _static):
+        _files_to_embed.extend(asciinema.casts_in(md_str))
+
+        if not r.incomplete:
+            indexed_slugs.add(r.get_slug())
+
+        slug = r.get_slug()
+        related_slugs = related.top(slug) if slug in related else []
+        # the post-processed article only depends on the post and the files it embeds,
+        # the page also depends on the template and the related posts.
+        # an identical page is not written, so the versions of the fragment and template it was
+        # last rendered from are kept in a stamp
+        fragment_fname = fragment_file(slug)
+        rendered_stamp = fragment_fname.with_suffix('.rendered')
+        fragment_fresh = (html_fname.is_file() and fragment_fname.is_file()
+                          and newer(fragment_fname, [post_file, this_script] + FRAGMENT_CODE + _files_to_embed))
+        if fragment_fresh:
+            fragment = fragment_fname.read_text(encoding='utf-8')
+            # the index may have lost the post (new index version, interrupted build)
+            if not r.incomplete and r.get_slug() not in search:
+                search.add(r, parse_fragment(fragment))
+            if (rendered_stamp.is_file() and rendered_stamp.read_text() == page_inputs(fragment_fname)
+                    and not (slug in related and related.top_changed(slug))):
                 #debug('Stale file')
                 continue
-
-        debug('generating text post')
-        html_str = generate_post(header, body, r)
-        html = BeautifulSoup(html_str, features='html5lib')
-        for header in html.find('article').find_all(["h2", "h3", "h4"]):
-            header.attrs["id"] = header.text.lower().replace(' ', '-').replace("'", "")
-            anchor = html.new_tag("a", href=f'#{header.attrs["id"]}', **{"data-header":"1"})
-            header.wrap(anchor)
-        html = merge_spans(html)
-
-        # lint pass
-        bad = False
-        if r.date.year >= 2024:
-            for anchor in html.find_all('a'):
-                if 'here' in anchor.text.lower() and 'coherency' not in anchor.text.lower():
-                    print(anchor.text)
-                    print(anchor.parent.text)
-                    bad = True
-
-                href = anchor.attrs.get('href')
-                if href.startswith("/posts/") and not href.endswith("/") and '#' not in href:
-                    print(f'Anchor "{anchor.text}" does not end in trailing slash: "{href}"')
-                    bad = True
-        if bad:
-            print("bad anchor on ", r.get_slug())
-            sys.exit(1)
-
-        # TODO: this should also be considered for 'newer'??
-        build_relative_assets(post_dir)
-        copy_relative_assets(html, assets_dir, post_dir)
-        copy_post_md(assets_dir, post_dir)
-
-
-        if html.find('asciinema-player'):
-            body = html.find('body')
-            assert body is not None
-            body.insert_after(html.new_tag('script', src="/js/asciinema-player.js"))
-
-        blog_post = str(html)
+            debug('re-rendering text post')
+        else:
+            debug('generating text post')
+            # convert pass runs after modification of source markdown
+            # so we need to convert it again (once for metadata), if any of the above
+            # modify the text
+            fragment = postprocess(convert(md_str), r, post_dir, assets_dir, search)
+            fragment_fname.parent.mkdir(parents=True, exist_ok=True)
+            fragment_fname.write_text(fragment, encoding='utf-8')
+
+        blog_post = generate_post(header, fragment, r, [published[s][0] for s in related_slugs])
         debug('writing to file')
-        open(html_fname, 'w', encoding='utf-8').write(blog_post)
+        output.write(html_fname, blog_post)
+        rendered_stamp.write_text(page_inputs(fragment_fname))
+        if slug in related:
+            related.rendered(slug)
         debug('finished')
         taken = time.time() - _time_start
         debug(f'time to build {r.get_title()} was {taken}')
+
+    if not filter_name:
+        # partial builds don't know about every post
+        search.prune(indexed_slugs)
+    shards = search.write()
+    debug(f'wrote {shards} search index shards')
+    related.save()
     taken_all = time.time() - _all_time_start
     debug(f'time to build all {taken_all}')
 
 
+def remove_element(el):
+    """Removes `el` from the tree, keeping its tail text in place"""
+    parent = el.getparent()
+    if el.tail:
+        prev = el.getprevious()
+        if prev is not None:
+            prev.tail = (prev.tail or '') + el.tail
+        else:
+            parent.text = (parent.text or '') + el.tail
+    parent.remove(el)
+
+
+def wrap(el, wrapper):
+    """Puts `el` inside `wrapper`, which takes its place in the tree"""
+    el.addprevious(wrapper)
+    wrapper.tail, el.tail = el.tail, None
+    wrapper.append(el)
+
+
+def set_text(el, text: str):
+    """Replaces the contents of `el` with `text`"""
+    for child in list(el):
+        el.remove(child)
+    el.text = text
+
+
+def child_nodes(el) -> list:
+    """The children of `el`, with its text and tails as strings in between"""
+    nodes = [el.text] if el.text else []
+    for child in el:
+        nodes.append(child)
+        if child.tail:
+            nodes.append(child.tail)
+    return nodes
+
+
+def set_child_nodes(el, nodes: list):
+    el.text = None
+    for child in list(el):
+        el.remove(child)
+    last = None
+    for node in nodes:
+        if not isinstance(node, str):
+            node.tail = None
+            el.append(node)
+            last = node
+        elif last is None:
+            el.text = (el.text or '') + node
+        else:
+            last.tail = (last.tail or '') + node
+
+
+def previous_node(el):
+    """The node right before `el`: a string (the preceding text) or an element"""
+    prev = el.getprevious()
+    if prev is None:
+        return el.getparent().text or None
+    return prev.tail or prev
+
+
+def page_inputs(fragment_fname: Path) -> str:
+    """The versions (mtimes) of the files a post's page is rendered from"""
+    return ' '.join(str(os.stat(f).st_mtime_ns) for f in (fragment_fname, BODY_TEMPLATE_FILE))
+
+
+def fragment_file(slug: str) -> Path:
+    """The cached post-processed article of a post, per markdown engine"""
+    return FRAGMENT_CACHE_DIR / MARKDOWN_ENGINE / f'{slug}.html'
+
+
+def parse_fragment(fragment: str):
+    """Parses an HTML fragment, its nodes end up inside a wrapper <div>"""
+    return lxml.html.fragment_fromstring(fragment, create_parent='div')
+
+
+def serialize_fragment(fragment) -> str:
+    return lxml.html.tostring(fragment, encoding='unicode')[len('<div>'):-len('</div>')]
+
+
+def postprocess(body: str, meta: PostMetadata, post_dir: Path, assets_dir: Path, search) -> str:
+    """
+    Post-processes the converted markdown of a post, before it goes into the
+    template: header anchors, the link lint, span merging, assets and code
+    block collapsing, asciinema placeholders. Also indexes the post for search.
+    """
+    fragment = parse_fragment(body)
+    add_header_anchors(fragment)
+    fragment = merge_spans(fragment)
+
+    # lint pass
+    bad = False
+    if meta.date.year >= 2024:
+        for anchor in fragment.iter('a'):
+            text = anchor.text_content()
+            if 'here' in text.lower() and 'coherency' not in text.lower():
+                print(text)
+                print(anchor.getparent().text_content())
+                bad = True
+
+            href = anchor.get('href')
+            if href.startswith("/posts/") and not href.endswith("/") and '#' not in href:
+                print(f'Anchor "{anchor.text}" does not end in trailing slash: "{href}"')
+                bad = True
+    if bad:
+        print("bad anchor on ", meta.get_slug())
+        sys.exit(1)
+
+    # TODO: this should also be considered for 'newer'??
+    build_relative_assets(post_dir)
+    copy_relative_assets(fragment, assets_dir, post_dir)
+    copy_post_md(assets_dir, post_dir)
+
+    if not meta.incomplete:
+        search.add(meta, fragment)
+
+    # after indexing, the posters are not part of the text
+    asciinema.replace_players(fragment)
+    collapse_large_code_blocks(fragment, assets_dir)
+    return serialize_fragment(fragment)
+
+
+def add_header_anchors(fragment):
+    """Gives every h2-h4 an id from its text, and wraps it in a link to itself"""
+    for header in list(fragment.iter("h2", "h3", "h4")):
+        header.set("id", header.text_content().lower().replace(' ', '-').replace("'", ""))
+        anchor = lxml.html.Element("a", {"data-header": "1", "href": f'#{header.get("id")}'})
+        wrap(header, anchor)
+
+
+def page_scripts(fragment: str) -> list[str]:
+    """Scripts needed by the post-processed article"""
+    scripts = []
+    if 'class="asciinema-placeholder"' in fragment:
+        scripts.append(asciinema.LOADER_SCRIPT)
+    if 'class="code-collapsed"' in fragment:
+        scripts.append("/js/code-expand.js")
+    return scripts
+
+
 # pygments is pretty silly, generating about 2x as many DOM elements
 # as necessary. this squashes it to something more reasonable, instead
 # of 1 class per token
 # also, because `p` and `n` are both unstyled, merge them
 def merge_spans(html):
-    from bs4 import NavigableString
-
-    for pre in html.find_all('pre'):
-        code = pre.find('code')
-        if not code:
+    for pre in list(html.iter('pre')):
+        code = pre.find('.//code')
+        if code is None:
             continue
 
         # Pass 0: Merge raw text + whitespace spans into single n span
-        children = list(code.children)
-        i = 0
-        while i < len(children):
-            child = children[i]
-            is_text = isinstance(child, NavigableString) and child.strip()
-            is_w_span = hasattr(child, 'name') and child.name == 'span' and child.get('class') == ['w']
-
-            if is_text or is_w_span:
-                collected = []
-                j = i
-                while j < len(children):
-                    c = children[j]
-                    c_is_text = isinstance(c, NavigableString) and c.strip()
-                    c_is_w_span = hasattr(c, 'name') and c.name == 'span' and c.get('class') == ['w']
-
-                    if c_is_text or c_is_w_span:
-                        if isinstance(c, NavigableString):
-                            collected.append(str(c))
-                        else:
-                            collected.append(c.get_text())
-                        j += 1
-                    else:
-                        break
-
-                if len(collected) > 0:
-                    new_span = html.new_tag('span', **{'class': 'n'})
-                    new_span.string = ''.join(collected)
-
-                    children[i].insert_before(new_span)
-                    for k in range(i, j):
-                        if hasattr(children[k], 'decompose'):
-                            children[k].decompose()
-                        elif isinstance(children[k], NavigableString):
-                            children[k].extract()
-
-                    children = list(code.children)
-                    i = 0
+        nodes = []
+        collected: list[str] = []
+
+        def flush():
+            if collected:
+                new_span = lxml.html.Element('span', {'class': 'n'})
+                new_span.text = ''.join(collected)
+                nodes.append(new_span)
+                collected.clear()
+
+        for child in child_nodes(code):
+            if isinstance(child, str):
+                if child.strip():
+                    collected.append(child)
                     continue
-            i += 1
-
-        spans = pre.find_all('span')
+            elif child.tag == 'span' and child.get('class') == 'w':
+                collected.append(child.text_content())
+                continue
+            flush()
+            nodes.append(child)
+        flush()
+        set_child_nodes(code, nodes)
 
         # Pass 1: Absorb whitespace spans (class w) into next sibling
-        for span in spans:
-            if span.get('class') == ['w'] and span.next_sibling and span.next_sibling.name == 'span':
-                next_span = span.next_sibling
-                next_span.string = span.get_text() + next_span.get_text()
-                span.decompose()
+        for span in list(pre.iter('span')):
+            next_span = span.getnext()
+            if span.get('class') == 'w' and not span.tail and next_span is not None and next_span.tag == 'span':
+                set_text(next_span, span.text_content() + next_span.text_content())
+                remove_element(span)
 
         # Pass 2: Convert all class p to class n
-        spans = pre.find_all('span')
-        for span in spans:
-            if span.get('class') == ['p']:
-                span['class'] = ['n']
+        for span in pre.iter('span'):
+            if span.get('class') == 'p':
+                span.set('class', 'n')
 
         # Pass 3: Merge consecutive spans with same class
-        spans = list(pre.find_all('span'))
+        spans = list(pre.iter('span'))
         i = 0
         while i < len(spans):
             current = spans[i]
-            current_class = current.get('class', [])
+            current_class = current.get('class')
 
             j = i + 1
-            while j < len(spans) and spans[j].get('class', []) == current_class:
-                if spans[j].previous_sibling == current or (isinstance(spans[j].previous_sibling, str) and spans[j].previous_sibling.strip() == ''):
-                    between = []
-                    for sibling in current.next_siblings:
-                        if sibling == spans[j]:
+            while j < len(spans) and spans[j].get('class') == current_class:
+                prev = previous_node(spans[j])
+                if prev is current or (isinstance(prev, str) and prev.strip() == ''):
+                    # the text between both spans
+                    between = [current.tail or '']
+                    current.tail = None
+                    for sibling in current.itersiblings():
+                        if sibling is spans[j]:
                             break
-                        if isinstance(sibling, str):
-                            between.append(sibling)
-
-                    current.string = current.get_text() + ''.join(between) + spans[j].get_text()
-                    spans[j].decompose()
-                    for text in between:
-                        if hasattr(text, 'extract'):
-                            text.extract()
+                        between.append(sibling.tail or '')
+                        sibling.tail = None
+
+                    set_text(current, current.text_content() + ''.join(between) + spans[j].text_content())
+                    remove_element(spans[j])
                     j += 1
                 else:
                     break
@@ -690,136 +1114,261 @@ def merge_spans(html):
 
     return html
 
-def generate_feed():
-    fg = FeedGenerator()
-    fg.id(BLOG_URL)
-    fg.title('Mumbling about computers')
-    fg.author({'name': 'David Ventura',
-               'email': 'hello@davidv.dev'})
-    fg.link(href=BLOG_URL, rel='alternate')
-    fg.link(href=("%srss.xml" % BLOG_URL), rel='self')
-    fg.description('Exploring software development, embedded systems, and homelab projects.')
-    fg.language('en')
-    fg.logo('https://blog.davidv.dev/images/logo.svg')
-    return fg
-
-
-def make_rss_entry(feed, item: PostMetadata):
-    # Should've used ATOM ._. no unique id
-    fe = feed.add_entry()
-    url = item.full_url
-    fe.id(url.rstrip('/'))  # started with no trailing slash, need to keep it to prevent
-    # duplicating feeds everywhere
-    tstamp = datetime.combine(item.date, datetime.min.time())
-    tstamp = pytz.timezone("Europe/Amsterdam").localize(tstamp)
-    fe.link(href=url)
-    fe.author({'name': 'David Ventura',
-               'email': 'hello@davidv.dev'})
-    fe.pubDate(tstamp)
-    fe.title(item.get_title())
-    if item.description:
-        fe.description(item.description)
-    # everything was mutated inside feed
-    return tstamp
 
+def text_pieces(el, root=True):
+    """(element, 'text' | 'tail') for every piece of text inside `el`, in document order"""
+    yield el, 'text'
+    for child in el:
+        yield from text_pieces(child, False)
+    if not root:
+        yield el, 'tail'
 
-def generate_index():
-    items: List[PostMetadata] = []
-    feed = generate_feed()
-    last_update = None
-    for f in glob.glob("blog/raw/*/POST.md"):
-        item = PostMetadata.from_path(f)
-        if item.incomplete and not DEVMODE:
+
+def truncate_lines(code, n: int):
+    """Drops everything after the first `n` lines of `code`, keeping the markup of what remains."""
+    seen = 0
+    for node, attr in text_pieces(code):
+        text = getattr(node, attr) or ''
+        newlines = text.count('\n')
+        if seen + newlines < n:
+            seen += newlines
             continue
-        items.append(item)
+        cut = -1
+        for _ in range(n - seen):
+            cut = text.find('\n', cut + 1)
+        setattr(node, attr, text[:cut])
+        if attr == 'text':
+            for child in list(node):
+                node.remove(child)
+            if node is not code:
+                node.tail = None
+        el = node
+        while el is not code:
+            for sibling in list(el.itersiblings()):
+                el.getparent().remove(sibling)
+            el = el.getparent()
+            if el is not code:
+                el.tail = None
+        return
 
-    s_items = sorted(items, key=lambda k: k.date)
-    for item in s_items:
-        if item.incomplete:
+
+def collapse_large_code_blocks(html, assets_dir: Path) -> bool:
+    """
+    Replaces large code blocks with a preview of their first lines, and stores
+    the full (highlighted) block in the post's assets, linked from the preview.
+    Returns whether any block was collapsed.
+    """
+    fragments = set()
+    for pre in list(html.iter('pre')):
+        code = pre.find('.//code')
+        if code is None:
+            continue
+        lines = code.text_content().count('\n')
+        if lines < LARGE_CODE_BLOCK_LINES:
             continue
-        tstamp = make_rss_entry(feed, item)
-        if last_update is None:
-            last_update = tstamp
-        last_update = max(last_update, tstamp)
+        block = pre
+        parent = pre.getparent()
+        if parent.tag == 'div' and 'codehilite' in parent.get('class', '').split():
+            block = parent
+        full = lxml.html.tostring(block, encoding='unicode', with_tail=False)
+        fname = f'code-{hashlib.sha256(full.encode()).hexdigest()[:16]}.html'
+        output.write(assets_dir / fname, full)
+        fragments.add(fname)
+
+        holder = lxml.html.Element('div', {'class': 'code-collapsed'})
+        wrap(block, holder)
+        truncate_lines(code, COLLAPSED_PREVIEW_LINES)
+        expand = lxml.html.Element('a', {'class': 'code-expand', 'href': f'assets/{fname}'})
+        expand.text = f'Show all {lines} lines'
+        holder.append(expand)
+
+    # fragments of blocks which changed or no longer exist
+    for f in assets_dir.glob('code-*.html'):
+        if f.name not in fragments:
+            f.unlink()
+    return bool(fragments)
+
+
+@lru_cache(maxsize=None)
+def feed_content(slug: str, url: str) -> Optional[str]:
+    """The cached article of a post, with absolute links; None if the post was never built"""
+    fragment_fname = fragment_file(slug)
+    if not fragment_fname.is_file():
+        return None
+    fragment = parse_fragment(fragment_fname.read_text(encoding='utf-8'))
+    fragment.make_links_absolute(url)
+    return serialize_fragment(fragment)
+
+
+def generate_feeds(items: List[PostMetadata], base_url: str, title: str) -> int:
+    """Writes {base_url}rss.xml and atom.xml with the newest `items`, returns how many were written"""
+    # drafts are listed in dev mode, but never published in feeds
+    items = [item for item in items if not item.incomplete]
+    entries = [feeds.FeedEntry(id=item.full_url.rstrip('/'),
+                               url=item.full_url,
+                               title=item.get_title(),
+                               description=item.description,
+                               published=datetime.combine(item.date, datetime.min.time(), feeds.TIMEZONE),
+                               content=feed_content(item.get_slug(), item.full_url))
+               for item in items[::-1][:feeds.MAX_ENTRIES]]
+    for entry in entries:
+        entry.updated = feeds.updated(entry, BUILD_TIME)
+    out_dir = Path('blog/html') / base_url.lstrip('/')
+    page_url = f'{BLOG_URL}{base_url.lstrip("/")}'
+    written = 0
+    for name, render in [('rss.xml', feeds.rss), ('atom.xml', feeds.atom)]:
+        feed = feeds.Feed(title=title, url=page_url, feed_url=f'{page_url}{name}', entries=entries)
+        written += output.write(out_dir / name, ''.join(render(feed)))
+    return written
 
-    rendered = INDEX_TEMPLATE.render(index=reversed(s_items), base_url=BLOG_URL, full_url=BLOG_URL)
-    assert rendered is not None
-    open('blog/html/index.html', 'w', encoding='utf-8').write(rendered)
-    feed.updated(last_update)
-    feed.rss_file('blog/html/rss.xml', pretty=True)
 
-def get_all_series() -> set[str]:
-    series: set[str] = set()
-    for f in glob.glob("blog/raw/*/POST.md"):
-        item = PostMetadata.from_path(f)
-        if item.series:
-            series.add(item.series)
-    return series
+@dataclass
+class IndexPage:
+    url: str
+    posts: List[PostMetadata]
+    # None for the landing page
+    number: Optional[int] = None
+    # newer/older pages
+    prev_url: Optional[str] = None
+    next_url: Optional[str] = None
 
-def get_all_tags() -> set[str]:
-    tags: set[str] = set()
-    for f in glob.glob("blog/raw/*/POST.md"):
-        item = PostMetadata.from_path(f)
-        tags = tags.union(set(item.tags))
-    return tags
+    @property
+    def path(self) -> Path:
+        return Path('blog/html') / self.url.lstrip('/') / 'index.html'
 
-def generate_tag_index(tag):
-    items: List[PostMetadata] = []
-    for f in glob.glob("blog/raw/*/POST.md"):
-        item = PostMetadata.from_path(f)
-        if tag not in item.tags:
-            continue
-        if item.incomplete and not DEVMODE:
-            continue
-        items.append(item)
 
-    s_items = sorted(items, key=lambda k: k.date, reverse=True)
-    rendered = INDEX_TEMPLATE.render(index=s_items, tag=tag, base_url=BLOG_URL, full_url=f'{BLOG_URL}tags/{tag}/')
-    assert rendered is not None
-    fpath = Path('blog/html/tags/%s/index.html' % tag)
-    fpath.parent.mkdir(parents=True, exist_ok=True)
-    open(str(fpath), 'w', encoding='utf-8').write(rendered)
+def paginate(items: List[PostMetadata], base_url: str) -> List[IndexPage]:
+    """
+    Splits `items` (sorted oldest first) into pages of POSTS_PER_PAGE posts,
+    numbered from the oldest post, so that a new post does not shift every
+    post into a different page.
+    The landing page at `base_url` holds the newest, partial, page plus the last full page;
+    the full pages before that are at `{base_url}page/<n>/`.
+    """
+    full_pages = len(items) // POSTS_PER_PAGE
+    if full_pages < 2:
+        return [IndexPage(url=base_url, posts=items[::-1])]
+
+    def page_url(number: int) -> str:
+        if number >= full_pages:
+            return base_url
+        return f'{base_url}page/{number}/'
+
+    landing_start = (full_pages - 1) * POSTS_PER_PAGE
+    pages = [IndexPage(url=base_url, posts=items[landing_start:][::-1], next_url=page_url(full_pages - 1))]
+    for number in range(full_pages - 1, 0, -1):
+        chunk = items[(number - 1) * POSTS_PER_PAGE:number * POSTS_PER_PAGE]
+        pages.append(IndexPage(url=page_url(number),
+                               posts=chunk[::-1],
+                               number=number,
+                               prev_url=page_url(number + 1),
+                               next_url=page_url(number - 1) if number > 1 else None))
+    return pages
+
+
+def speculation_rules(items: List[PostMetadata]) -> str:
+    """Rules to prefetch the posts listed on a page when hovered, and prerender them when clicked"""
+    urls = [item.relative_url for item in items]
+    return json.dumps({
+        'prefetch': [{'source': 'list', 'urls': urls, 'eagerness': 'moderate'}],
+        'prerender': [{'source': 'list', 'urls': urls, 'eagerness': 'conservative'}],
+    })
+
+
+def render_index_pages(items: List[PostMetadata], base_url: str, search=False, **kwargs) -> int:
+    """Renders the (paginated) index for `items`, returns how many pages were written."""
+    written = 0
+    pages = paginate(items, base_url)
+    for page in pages:
+        rendered = INDEX_TEMPLATE.render(cards=[post_card(p) for p in page.posts],
+                                         speculation_rules=speculation_rules(page.posts),
+                                         page=page.number,
+                                         prev_url=page.prev_url,
+                                         next_url=page.next_url,
+                                         search=search and page.number is None,
+                                         base_url=BLOG_URL,
+                                         devmode=DEVMODE,
+                                         full_url=f'{BLOG_URL}{page.url.lstrip("/")}',
+                                         **kwargs)
+        assert rendered is not None
+        written += output.write(page.path, rendered)
+
+    # pages beyond the current page count, when the index (or tag) shrank
+    current = {page.path for page in pages}
+    for stale in (Path('blog/html') / base_url.lstrip('/') / 'page').glob('*/index.html'):
+        if stale not in current:
+            stale.unlink()
+            stale.parent.rmdir()
+    return written
+
+
+def generate_archive(items: List[PostMetadata]):
+    """Renders one page per year, plus an index of years at /archive/"""
+    by_year: dict[int, List[PostMetadata]] = {}
+    for item in items:
+        by_year.setdefault(item.date.year, []).append(item)
+
+    written = 0
+    for year, year_items in by_year.items():
+        rendered = INDEX_TEMPLATE.render(cards=[post_card(p) for p in year_items[::-1]], year=year, base_url=BLOG_URL, devmode=DEVMODE,
+                                         speculation_rules=speculation_rules(year_items),
+                                         full_url=f'{BLOG_URL}archive/{year}/')
+        written += output.write(Path(f'blog/html/archive/{year}/index.html'), rendered)
+    rendered = INDEX_TEMPLATE.render(cards=[], years=sorted(by_year, reverse=True), base_url=BLOG_URL, devmode=DEVMODE,
+                                     full_url=f'{BLOG_URL}archive/')
+    written += output.write(Path('blog/html/archive/index.html'), rendered)
+    return written
 
-def generate_series_index(series):
-    items: List[PostMetadata] = []
-    for f in glob.glob("blog/raw/*/POST.md"):
-        item = PostMetadata.from_path(f)
-        if series != item.series:
-            continue
-        if item.incomplete and not DEVMODE:
-            continue
-        items.append(item)
 
-    s_items = sorted(items, key=lambda k: k.date, reverse=True)
-    rendered = INDEX_TEMPLATE.render(index=s_items, series=series, base_url=BLOG_URL, full_url=f'{BLOG_URL}series/{series}/')
-    assert rendered is not None
-    fpath = Path(f'blog/html/series/{series}/index.html')
-    fpath.parent.mkdir(parents=True, exist_ok=True)
-    open(str(fpath), 'w', encoding='utf-8').write(rendered)
+def generate_index():
+    # sorted by (date, slug); slug breaks ties, so that pagination is stable across builds
+    s_items = get_posts()
+    written = render_index_pages(s_items, '/', search=True)
+    written += generate_archive(s_items)
+    debug(f'wrote {written} index pages')
+    written = generate_feeds(s_items, '/', feeds.TITLE)
+    debug(f'wrote {written} feeds')
+
+def draft_pages() -> set[str]:
+    """The pages of drafts (relative to blog/html), which dev builds leave behind"""
+    return {f'posts/{row["slug"]}/index.html' for row in get_catalog().posts(drafts=True) if row['draft']}
 
-def generate_sitemap():
-    items: List[PostMetadata] = []
-    for f in glob.glob("blog/raw/*/POST.md"):
-        item = PostMetadata.from_path(f)
-        if item.incomplete and not DEVMODE:
-            continue
-        items.append(item)
+def get_all_series() -> set[str]:
+    return set(get_catalog().series())
 
-    s_items = sorted(items, key=lambda k: k.date, reverse=True)
+def get_all_tags() -> set[str]:
+    # includes the tags only used by drafts, their page is empty
+    return {tag for tag, _ in get_catalog().tags(drafts=True)}
 
-    root = ET.Element('urlset', xmlns="http://www.sitemaps.org/schemas/sitemap/0.9")
+def generate_tag_index(tag):
+    s_items = get_posts(tag=tag)
+    render_index_pages(s_items, f'/tags/{tag}/', tag=tag)
+    generate_feeds(s_items, f'/tags/{tag}/', f'{feeds.TITLE} - {tag}')
 
-    url_elem = ET.SubElement(root, 'url')
-    ET.SubElement(url_elem, 'loc').text = BLOG_URL
+def generate_series_index(series):
+    s_items = get_posts(series=series)[::-1]
+    rendered = INDEX_TEMPLATE.render(cards=[post_card(p) for p in s_items], series=series, base_url=BLOG_URL, devmode=DEVMODE, full_url=f'{BLOG_URL}series/{series}/',
+                                     speculation_rules=speculation_rules(s_items))
+    assert rendered is not None
+    output.write(Path(f'blog/html/series/{series}/index.html'), rendered)
 
+def generate_sitemap():
+    """Posts, oldest first (so that new posts only change the last shard), then the index and the tag pages"""
+    s_items = get_posts()
+    if not s_items:
+        return
+    entries = [sitemap.SitemapEntry(item.full_url, Path(f'blog/html/posts/{item.get_slug()}/index.html'), item.date)
+               for item in s_items]
+    entries.append(sitemap.SitemapEntry(BLOG_URL, Path('blog/html/index.html'), s_items[-1].date))
+    newest_by_tag: dict[str, date] = {}
     for item in s_items:
-        url_elem = ET.SubElement(root, 'url')
-        ET.SubElement(url_elem, 'loc').text = item.full_url
-        ET.SubElement(url_elem, 'lastmod').text = item.date.isoformat()
-
-    tree = ET.ElementTree(root)
-    ET.indent(tree, space="  ")
-    tree.write('blog/html/sitemap.xml', encoding='utf-8', xml_declaration=True)
+        for tag in item.tags:
+            newest_by_tag[tag] = max(newest_by_tag.get(tag, item.date), item.date)
+    for tag in sorted(newest_by_tag):
+        entries.append(sitemap.SitemapEntry(f'{BLOG_URL}tags/{tag}/', Path(f'blog/html/tags/{tag}/index.html'),
+                                            newest_by_tag[tag]))
+    written = sitemap.write(entries, BLOG_URL)
+    debug(f'wrote {written} sitemap files')
 
 if __name__ == '__main__':
     DEVMODE = False
@@ -830,10 +1379,28 @@ if __name__ == '__main__':
     #    generate_series_index(series_name)
     filter_name = sys.argv[2] if len(sys.argv) > 2 else None
     main(filter_name)
+    asciinema.compress_casts()
     # This is a hack for devmode, probably should be cached?
     if not filter_name:
         tags = get_all_tags()
         for tag in tags:
             generate_tag_index(tag)
-        generate_sitemap()
     generate_index()
+    feeds.save_state()
+    if not filter_name:
+        # after every page is written, their content is what goes into lastmod
+        generate_sitemap()
+        # redirects.caddy and preload.caddy are deployed with the Caddyfile,
+        # dev builds (which include drafts) leave them alone
+        if not DEVMODE:
+            count = redirects.write(get_posts())
+            debug(f'{count} redirects from historical urls')
+        service_worker.write([item.relative_url for item in get_posts()])
+    print(output.summary())
+    if not filter_name:
+        page_audit.print_summary(page_audit.audit())
+        if not DEVMODE:
+            drafts = draft_pages()
+            count = preload.write({name: summary for name, summary in page_audit.load_summaries().items()
+                                   if name not in drafts})
+            debug(f'preload headers for {count} pages')
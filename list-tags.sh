@@ -1,2 +1,3 @@
 #!/bin/bash
-git grep -wh ^tags blog/raw/ | sort | cut -d: -f2  | xargs | tr -d , | tr ' ' '\n'| sort | uniq -c | sort -n
+# tags with their post count, from the metadata catalog (see catalog.py)
+python catalog.py
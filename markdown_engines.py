@@ -0,0 +1,222 @@
+"""
+Markdown engines the blog can be rendered with, selected with the
+MARKDOWN_ENGINE environment variable (default: markdown2).
+
+Every engine supports the extras the posts use: fenced code blocks
+(highlighted with pygments), footnotes, tables, header ids, strike,
+cuddled lists and a front matter block, and renders them with the same
+markup as markdown2, which the CSS and the post-processing expect.
+Both engines share the pygments highlighting, so they only differ in
+how they parse markdown.
+
+Run directly to render every post with every engine, compare the
+normalized HTML and time each engine:
+
+    python markdown_engines.py [--diff]
+"""
+import difflib
+import re
+import sys
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import lxml.html
+from markdown2 import Markdown, _slugify
+from markdown_it import MarkdownIt
+from markdown_it.common.utils import escapeHtml
+from mdit_py_plugins.footnote import footnote_plugin
+from mdit_py_plugins.front_matter import front_matter_plugin
+
+MARKDOWN2_EXTRAS = ["fenced-code-blocks", "cuddled-lists", "footnotes", "metadata", "tables", "header-ids", "strike"]
+
+
+class HighlightCachingMarkdown(Markdown):
+    """
+    Memoizes pygments highlighting of code blocks, so the same code (eg: a file
+    embedded in multiple posts) is only highlighted once per build.
+    """
+    _highlighted: dict[tuple, str] = {}
+
+    def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
+        key = (codeblock, type(lexer), tuple(sorted(formatter_opts.items())))
+        if key not in self._highlighted:
+            self._highlighted[key] = super()._color_with_pygments(codeblock, lexer, **formatter_opts)
+        return self._highlighted[key]
+
+
+class MarkdownEngine(ABC):
+    name: str
+
+    @abstractmethod
+    def convert(self, text: str) -> str:
+        """Renders the (preprocessed) markdown of a post to HTML"""
+
+
+class Markdown2Engine(MarkdownEngine):
+    name = 'markdown2'
+
+    def __init__(self):
+        self.md = HighlightCachingMarkdown(extras=MARKDOWN2_EXTRAS)
+
+    def convert(self, text: str) -> str:
+        return self.md.convert(text)
+
+
+def footnote_id(token) -> str:
+    # same normalization as markdown2
+    label = token.meta.get('label')
+    if label is None:
+        return str(token.meta['id'] + 1)
+    return re.sub(r'\W', '-', label)
+
+
+class MarkdownItEngine(MarkdownEngine):
+    """
+    markdown-it-py (CommonMark, with the table and strikethrough rules)
+    plus the front matter and footnote plugins, with renderer rules that
+    produce markdown2's markup.
+    """
+    name = 'markdown-it'
+
+    def __init__(self):
+        # only used for its (cached) pygments highlighting
+        self.highlighter = HighlightCachingMarkdown(extras=MARKDOWN2_EXTRAS)
+        self.md = (MarkdownIt('commonmark', {'xhtmlOut': True})
+                   .enable(['table', 'strikethrough'])
+                   .use(front_matter_plugin)
+                   .use(footnote_plugin))
+        self.md.core.ruler.push('header_ids', self.header_ids)
+        rules = {
+            'fence': self.render_fence,
+            'footnote_ref': self.render_footnote_ref,
+            'footnote_block_open': lambda *_: '<div class="footnotes">\n<hr />\n<ol>\n',
+            'footnote_block_close': lambda *_: '</ol>\n</div>\n',
+            'footnote_open': lambda tokens, idx, *_: f'<li id="fn-{footnote_id(tokens[idx])}">\n',
+            'footnote_close': lambda *_: '</li>\n',
+            'footnote_anchor': self.render_footnote_anchor,
+        }
+        # rules are called as rule(tokens, idx, options, env)
+        self.md.renderer.rules.update(rules)
+
+    @staticmethod
+    def header_ids(state):
+        """Gives every heading an id, like markdown2's header-ids extra"""
+        counts: dict[str, int] = {}
+        for i, token in enumerate(state.tokens):
+            if token.type != 'heading_open':
+                continue
+            header_id = _slugify(state.tokens[i + 1].content)
+            counts[header_id] = counts.get(header_id, 0) + 1
+            if not header_id or counts[header_id] > 1:
+                header_id += f'-{counts[header_id]}'
+            token.attrSet('id', header_id)
+
+    def render_fence(self, tokens, idx, options, env):
+        token = tokens[idx]
+        lang = token.info.strip().split(' ')[0]
+        lexer = self.highlighter._get_pygments_lexer(lang) if lang else None
+        if lexer is None:
+            return f'<pre><code>{escapeHtml(token.content)}</code></pre>\n'
+        return self.highlighter._color_with_pygments(token.content, lexer)
+
+    @staticmethod
+    def render_footnote_ref(tokens, idx, options, env):
+        token = tokens[idx]
+        ident = footnote_id(token)
+        return f'<sup class="footnote-ref" id="fnref-{ident}"><a href="#fn-{ident}">{token.meta["id"] + 1}</a></sup>'
+
+    @staticmethod
+    def render_footnote_anchor(tokens, idx, options, env):
+        token = tokens[idx]
+        return (f'&#160;<a href="#fnref-{footnote_id(token)}" class="footnoteBackLink" '
+                f'title="Jump back to footnote {token.meta["id"] + 1} in the text.">&#8617;</a>')
+
+    def convert(self, text: str) -> str:
+        # markdown2 expands tabs before parsing, which shows in code blocks
+        return self.md.render(text.expandtabs(4))
+
+
+ENGINES: dict[str, type[MarkdownEngine]] = {
+    Markdown2Engine.name: Markdown2Engine,
+    MarkdownItEngine.name: MarkdownItEngine,
+}
+
+
+def get_engine(name: str) -> MarkdownEngine:
+    if name not in ENGINES:
+        raise ValueError(f'Unknown markdown engine "{name}", available: {", ".join(ENGINES)}')
+    return ENGINES[name]()
+
+
+def normalize(html: str) -> str:
+    """
+    Reduces rendered HTML to what a browser would display: collapsed whitespace
+    outside of <pre>, sorted attributes, no empty paragraphs, one element per line.
+    """
+    root = lxml.html.fragment_fromstring(html, create_parent='div')
+    for p in root.xpath('//p[not(node())]'):
+        p.drop_tree()
+    for el in root.iter():
+        if isinstance(el.tag, str):
+            attrs = sorted((k, re.sub(r'\s*;\s*$', '', v)) for k, v in el.attrib.items())
+            el.attrib.clear()
+            el.attrib.update(attrs)
+        in_pre = any(a.tag == 'pre' for a in el.iterancestors())
+        if el.tail is not None and not in_pre:
+            el.tail = re.sub(r'\s+', ' ', el.tail).strip() or None
+        if el.text is not None and not in_pre and el.tag != 'pre':
+            el.text = re.sub(r'\s+', ' ', el.text).strip() or None
+    return lxml.html.tostring(root, encoding='unicode', pretty_print=True)
+
+
+def compare(show_diff: bool):
+    # generate imports this module, only import it when running the harness
+    from generate import DIRECTIVES, PostMetadata, preprocess
+    # don't run mermaid, diagrams are not markdown
+    directives = {**DIRECTIVES, 'embed-mermaid': lambda ctx, fname: ''}
+
+    posts = {}
+    for post_file in sorted(Path('blog/raw').glob('*/POST.md')):
+        text = post_file.read_text(encoding='utf-8')
+        meta = PostMetadata.from_text(text, with_series=False)
+        try:
+            posts[post_file.parent.name], _ = preprocess(post_file.parent, text, meta, directives)
+        except FileNotFoundError as e:
+            print(f'skipping {post_file.parent.name}: {e}')
+
+    rendered: dict[str, dict[str, str]] = {}
+    for name in ENGINES:
+        engine = get_engine(name)
+        # every engine pays for highlighting, the cache is shared
+        HighlightCachingMarkdown._highlighted.clear()
+        timings = {}
+        rendered[name] = {}
+        for post, text in posts.items():
+            start = time.perf_counter()
+            rendered[name][post] = engine.convert(text)
+            timings[post] = time.perf_counter() - start
+        slowest = max(timings, key=timings.__getitem__)
+        print(f'{name:12} {sum(timings.values()):6.2f}s total, '
+              f'slowest {slowest} ({timings[slowest]:.3f}s)')
+
+    reference, *others = ENGINES
+    for name in others:
+        different = []
+        for post in posts:
+            expected = normalize(rendered[reference][post])
+            got = normalize(rendered[name][post])
+            if expected == got:
+                continue
+            different.append(post)
+            if show_diff:
+                sys.stdout.writelines(difflib.unified_diff(expected.splitlines(keepends=True),
+                                                           got.splitlines(keepends=True),
+                                                           f'{reference}/{post}', f'{name}/{post}', n=1))
+        print(f'{name} renders {len(posts) - len(different)}/{len(posts)} posts like {reference}')
+        if different:
+            print(f'  different: {", ".join(different)}')
+
+
+if __name__ == '__main__':
+    compare(show_diff='--diff' in sys.argv[1:])
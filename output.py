@@ -0,0 +1,73 @@
+"""
+Writes the build output: a file is only written when its content differs
+from what is already on disk, so unchanged files keep their mtime (which
+rsync and the HTTP cache validators rely on), and changed files are written
+to a temporary file which is then renamed over the old one, so an
+interrupted build never leaves a truncated file behind.
+
+Every write is counted, `summary()` reports how many files were written and
+how many were skipped because they were unchanged.
+"""
+import filecmp
+import os
+import tempfile
+from pathlib import Path
+
+# tempfile creates files as 0600, use the permissions a plain open() would
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+written: list[Path] = []
+skipped = 0
+
+
+def _unchanged(fname: Path, data: bytes) -> bool:
+    try:
+        if fname.stat().st_size != len(data):
+            return False
+        return fname.read_bytes() == data
+    except FileNotFoundError:
+        return False
+
+
+def _replace(fname: Path, data: bytes):
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=fname.parent, prefix=f'.{fname.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, FILE_MODE)
+        os.replace(tmp, fname)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write(fname: Path, content: str | bytes) -> bool:
+    """Writes `content` to `fname` unless it already has that content. Returns whether it was written."""
+    global skipped
+    fname = Path(fname)
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    if _unchanged(fname, data):
+        skipped += 1
+        return False
+    _replace(fname, data)
+    written.append(fname)
+    return True
+
+
+def copy(src: Path, dst: Path) -> bool:
+    """Copies `src` to `dst` unless they are already identical. Returns whether it was copied."""
+    global skipped
+    dst = Path(dst)
+    if dst.is_file() and filecmp.cmp(src, dst, shallow=False):
+        skipped += 1
+        return False
+    _replace(dst, Path(src).read_bytes())
+    written.append(dst)
+    return True
+
+
+def summary() -> str:
+    return f'Wrote {len(written)} files, {skipped} unchanged'
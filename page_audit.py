@@ -0,0 +1,268 @@
+"""
+Audits the weight of every page in the build output against per-page budgets.
+
+For each page, the HTML is parsed once into a summary (DOM node count, inline
+script bytes, referenced assets); summaries are cached by the mtime/size of
+the page, so only pages written by the last build are parsed again. Asset
+sizes are taken from the filesystem on every run, as assets can change
+without the page changing.
+
+Budgets default to DEFAULT_BUDGETS and can be overridden per page in
+config/page-budgets.json, which maps glob patterns (relative to blog/html)
+to the budgets that change, eg: {"posts/some-post/*": {"asset_bytes": 8000000}}
+
+The report is written to page-audit.json; run this file directly to audit
+without building, the exit code is 1 when some page is over budget.
+"""
+import json
+import sys
+from dataclasses import dataclass, asdict
+from fnmatch import fnmatch
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+OUT_DIR = Path('blog/html')
+CACHE_FILE = Path('.cache/page-audit.json')
+BUDGETS_FILE = Path('config/page-budgets.json')
+REPORT_FILE = Path('page-audit.json')
+# bump when the summary changes, to re-parse every page
+VERSION = 3
+WORST_COUNT = 10
+# inline <script> types which are data, not code
+NOT_JAVASCRIPT = ('application/ld+json', 'speculationrules')
+
+DEFAULT_BUDGETS = {
+    'html_bytes': 250_000,
+    'dom_nodes': 5_000,
+    'asset_bytes': 5_000_000,
+    'largest_asset_bytes': 2_000_000,
+    'images': 40,
+    'script_bytes': 150_000,
+    # videos which start downloading on page load
+    'eager_videos': 0,
+}
+
+
+@dataclass
+class PageSummary:
+    mtime_ns: int
+    size: int
+    dom_nodes: int
+    inline_script_bytes: int
+    eager_videos: int
+    # [url, kind] where kind is one of image, lazy-image, video, script, style; in document order
+    assets: list[list[str]]
+
+
+@dataclass
+class PageWeight:
+    html_bytes: int
+    dom_nodes: int
+    asset_bytes: int
+    largest_asset_bytes: int
+    largest_asset: str
+    images: int
+    script_bytes: int
+    eager_videos: int
+    # referenced assets which are not in the build output
+    missing: list[str]
+
+
+class PageParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.dom_nodes = 0
+        self.inline_script_bytes = 0
+        self.eager_videos = 0
+        self.assets: list[list[str]] = []
+        self.in_script = False
+        self.in_video = False
+
+    def add_asset(self, url, kind):
+        if url and [url, kind] not in self.assets:
+            self.assets.append([url, kind])
+
+    def handle_starttag(self, tag, attrs):
+        self.dom_nodes += 1
+        attrs = dict(attrs)
+        if tag == 'img':
+            self.add_asset(attrs.get('src'), 'lazy-image' if attrs.get('loading') == 'lazy' else 'image')
+        elif tag == 'source':
+            kind = 'video' if self.in_video else 'image'
+            self.add_asset(attrs.get('src'), kind)
+            for candidate in (attrs.get('srcset') or '').split(','):
+                self.add_asset(candidate.strip().split(' ')[0], kind)
+        elif tag == 'video':
+            self.in_video = True
+            self.add_asset(attrs.get('src'), 'video')
+            self.add_asset(attrs.get('poster'), 'image')
+            if attrs.get('preload') not in ('none', 'metadata'):
+                self.eager_videos += 1
+        elif tag == 'script':
+            self.in_script = 'src' not in attrs and attrs.get('type') not in NOT_JAVASCRIPT
+            self.add_asset(attrs.get('src'), 'script')
+        elif tag == 'link' and 'stylesheet' in (attrs.get('rel') or '').split():
+            self.add_asset(attrs.get('href'), 'style')
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag == 'video':
+            self.in_video = False
+
+    def handle_endtag(self, tag):
+        if tag == 'script':
+            self.in_script = False
+        elif tag == 'video':
+            self.in_video = False
+
+    def handle_data(self, data):
+        if self.in_script:
+            self.inline_script_bytes += len(data.encode())
+
+
+def summarize(page: Path, mtime_ns: int, size: int) -> PageSummary:
+    parser = PageParser()
+    parser.feed(page.read_text())
+    parser.close()
+    return PageSummary(mtime_ns, size, parser.dom_nodes, parser.inline_script_bytes,
+                       parser.eager_videos, parser.assets)
+
+
+def asset_path(page: Path, url: str) -> Path | None:
+    """The file in the build output that `url` on `page` points to, None for external urls"""
+    parts = urlsplit(url)
+    if parts.scheme or parts.netloc or url.startswith('data:'):
+        return None
+    path = unquote(parts.path)
+    if path.startswith('/'):
+        return OUT_DIR / path.lstrip('/')
+    return page.parent / path
+
+
+def weigh(page: Path, summary: PageSummary, sizes: dict[Path, int | None]) -> PageWeight:
+    asset_bytes = 0
+    script_bytes = summary.inline_script_bytes
+    largest = (0, '')
+    missing = []
+    for url, kind in summary.assets:
+        path = asset_path(page, url)
+        if path is None:
+            continue
+        if path not in sizes:
+            sizes[path] = path.stat().st_size if path.is_file() else None
+        size = sizes[path]
+        if size is None:
+            missing.append(url)
+            continue
+        asset_bytes += size
+        largest = max(largest, (size, url))
+        if kind == 'script':
+            script_bytes += size
+    return PageWeight(
+        html_bytes=summary.size,
+        dom_nodes=summary.dom_nodes,
+        asset_bytes=asset_bytes,
+        largest_asset_bytes=largest[0],
+        largest_asset=largest[1],
+        images=sum(1 for _, kind in summary.assets if kind in ('image', 'lazy-image')),
+        script_bytes=script_bytes,
+        eager_videos=summary.eager_videos,
+        missing=missing,
+    )
+
+
+def load_budgets() -> list[tuple[str, dict[str, int]]]:
+    if not BUDGETS_FILE.exists():
+        return []
+    with BUDGETS_FILE.open() as fd:
+        overrides = json.load(fd)
+    for pattern, budgets in overrides.items():
+        unknown = budgets.keys() - DEFAULT_BUDGETS.keys()
+        if unknown:
+            raise ValueError(f'Unknown budgets {sorted(unknown)} for {pattern} in {BUDGETS_FILE}')
+    return list(overrides.items())
+
+
+def budgets_for(name: str, overrides: list[tuple[str, dict[str, int]]]) -> dict[str, int]:
+    budgets = dict(DEFAULT_BUDGETS)
+    for pattern, override in overrides:
+        if fnmatch(name, pattern):
+            budgets.update(override)
+    return budgets
+
+
+def load_summaries() -> dict[str, dict]:
+    if CACHE_FILE.exists():
+        with CACHE_FILE.open() as fd:
+            data = json.load(fd)
+        if data.get('version') == VERSION:
+            return data['pages']
+    return {}
+
+
+def audit() -> dict:
+    """Audits every page in the build output and writes the report; returns it."""
+    cached = load_summaries()
+    overrides = load_budgets()
+    summaries: dict[str, PageSummary] = {}
+    weights: dict[str, PageWeight] = {}
+    sizes: dict[Path, int | None] = {}
+    parsed = 0
+    for page in sorted(OUT_DIR.rglob('*.html')):
+        name = str(page.relative_to(OUT_DIR))
+        stat = page.stat()
+        summary = cached.get(name)
+        if summary is not None and summary['mtime_ns'] == stat.st_mtime_ns and summary['size'] == stat.st_size:
+            summaries[name] = PageSummary(**summary)
+        else:
+            summaries[name] = summarize(page, stat.st_mtime_ns, stat.st_size)
+            parsed += 1
+        weights[name] = weigh(page, summaries[name], sizes)
+
+    CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with CACHE_FILE.open('w') as fd:
+        json.dump({'version': VERSION, 'pages': {n: asdict(s) for n, s in summaries.items()}}, fd)
+
+    over_budget = []
+    for name, weight in weights.items():
+        budgets = budgets_for(name, overrides)
+        over = {metric: [getattr(weight, metric), budget] for metric, budget in budgets.items()
+                if getattr(weight, metric) > budget}
+        if over:
+            # how far over budget the page is, for its worst metric
+            ratio = max((value / budget) if budget else float('inf') for value, budget in over.values())
+            over_budget.append({'page': name, 'ratio': ratio, 'over': over})
+    # pages over a zero budget go first
+    over_budget.sort(key=lambda o: (-o['ratio'], o['page']))
+    for o in over_budget:
+        o['ratio'] = round(o['ratio'], 2) if o['ratio'] != float('inf') else None
+
+    report = {
+        'pages': len(weights),
+        'parsed': parsed,
+        'budgets': DEFAULT_BUDGETS,
+        'over_budget': over_budget,
+        'worst': {metric: [[name, getattr(w, metric)] for name, w in
+                           sorted(weights.items(), key=lambda nw: -getattr(nw[1], metric))[:WORST_COUNT]]
+                  for metric in DEFAULT_BUDGETS},
+        'missing_assets': {name: w.missing for name, w in weights.items() if w.missing},
+        'weights': {name: asdict(w) for name, w in weights.items()},
+    }
+    with REPORT_FILE.open('w') as fd:
+        json.dump(report, fd, indent=1, sort_keys=True)
+    return report
+
+
+def print_summary(report: dict):
+    print(f"Audited {report['pages']} pages ({report['parsed']} parsed), "
+          f"{len(report['over_budget'])} over budget, see {REPORT_FILE}")
+    for o in report['over_budget'][:WORST_COUNT]:
+        over = ', '.join(f'{metric} {value:,} > {budget:,}' for metric, (value, budget) in o['over'].items())
+        print(f"  {o['page']}: {over}")
+
+
+if __name__ == '__main__':
+    report = audit()
+    print_summary(report)
+    sys.exit(1 if report['over_budget'] else 0)
@@ -0,0 +1,236 @@
+"""
+Checks that post-processing with lxml (generate.py) produces the same
+articles as the html5lib + BeautifulSoup pipeline it replaced, which is
+kept here as the reference.
+
+Every post is converted once, then goes through both pipelines: header
+anchors, span merging and code block collapsing. The articles, and the
+collapsed code blocks stored in the assets, are compared as a browser
+would see them: parsed again with html5lib, then normalized (see
+markdown_engines.normalize).
+
+The reference parsers are not needed by the build, they are listed in
+requirements-dev.txt:
+
+    python postprocess_equivalence.py [--diff]
+"""
+import difflib
+import hashlib
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup, NavigableString
+
+import generate
+from markdown_engines import normalize
+
+
+# reference pipeline, as it was before lxml
+
+def reference_merge_spans(html):
+    for pre in html.find_all('pre'):
+        code = pre.find('code')
+        if not code:
+            continue
+
+        # Pass 0: Merge raw text + whitespace spans into single n span
+        children = list(code.children)
+        i = 0
+        while i < len(children):
+            child = children[i]
+            is_text = isinstance(child, NavigableString) and child.strip()
+            is_w_span = hasattr(child, 'name') and child.name == 'span' and child.get('class') == ['w']
+
+            if is_text or is_w_span:
+                collected = []
+                j = i
+                while j < len(children):
+                    c = children[j]
+                    c_is_text = isinstance(c, NavigableString) and c.strip()
+                    c_is_w_span = hasattr(c, 'name') and c.name == 'span' and c.get('class') == ['w']
+
+                    if c_is_text or c_is_w_span:
+                        if isinstance(c, NavigableString):
+                            collected.append(str(c))
+                        else:
+                            collected.append(c.get_text())
+                        j += 1
+                    else:
+                        break
+
+                if len(collected) > 0:
+                    new_span = html.new_tag('span', **{'class': 'n'})
+                    new_span.string = ''.join(collected)
+
+                    children[i].insert_before(new_span)
+                    for k in range(i, j):
+                        if hasattr(children[k], 'decompose'):
+                            children[k].decompose()
+                        elif isinstance(children[k], NavigableString):
+                            children[k].extract()
+
+                    children = list(code.children)
+                    i = 0
+                    continue
+            i += 1
+
+        spans = pre.find_all('span')
+
+        # Pass 1: Absorb whitespace spans (class w) into next sibling
+        for span in spans:
+            if span.get('class') == ['w'] and span.next_sibling and span.next_sibling.name == 'span':
+                next_span = span.next_sibling
+                next_span.string = span.get_text() + next_span.get_text()
+                span.decompose()
+
+        # Pass 2: Convert all class p to class n
+        spans = pre.find_all('span')
+        for span in spans:
+            if span.get('class') == ['p']:
+                span['class'] = ['n']
+
+        # Pass 3: Merge consecutive spans with same class
+        spans = list(pre.find_all('span'))
+        i = 0
+        while i < len(spans):
+            current = spans[i]
+            current_class = current.get('class', [])
+
+            j = i + 1
+            while j < len(spans) and spans[j].get('class', []) == current_class:
+                if spans[j].previous_sibling == current or (isinstance(spans[j].previous_sibling, str) and spans[j].previous_sibling.strip() == ''):
+                    between = []
+                    for sibling in current.next_siblings:
+                        if sibling == spans[j]:
+                            break
+                        if isinstance(sibling, str):
+                            between.append(sibling)
+
+                    current.string = current.get_text() + ''.join(between) + spans[j].get_text()
+                    spans[j].decompose()
+                    for text in between:
+                        if hasattr(text, 'extract'):
+                            text.extract()
+                    j += 1
+                else:
+                    break
+
+            i = j if j > i + 1 else i + 1
+
+    return html
+
+
+def reference_truncate_lines(code, n: int):
+    seen = 0
+    for text in code.find_all(string=True):
+        newlines = text.count('\n')
+        if seen + newlines < n:
+            seen += newlines
+            continue
+        cut = -1
+        for _ in range(n - seen):
+            cut = text.find('\n', cut + 1)
+        node = NavigableString(text[:cut])
+        text.replace_with(node)
+        while node is not code:
+            for sibling in list(node.next_siblings):
+                sibling.extract()
+            node = node.parent
+        return
+
+
+def reference_collapse_large_code_blocks(html, blocks: dict[str, str]):
+    """Like collapse_large_code_blocks, but stores the full blocks in `blocks` instead of the assets"""
+    for pre in html.find_all('pre'):
+        code = pre.find('code')
+        if code is None:
+            continue
+        lines = code.get_text().count('\n')
+        if lines < generate.LARGE_CODE_BLOCK_LINES:
+            continue
+        block = pre
+        if pre.parent.name == 'div' and 'codehilite' in pre.parent.get('class', []):
+            block = pre.parent
+        full = str(block)
+        fname = f'code-{hashlib.sha256(full.encode()).hexdigest()[:16]}.html'
+        blocks[fname] = full
+
+        holder = html.new_tag('div', **{'class': 'code-collapsed'})
+        block.wrap(holder)
+        reference_truncate_lines(code, generate.COLLAPSED_PREVIEW_LINES)
+        expand = html.new_tag('a', href=f'assets/{fname}', **{'class': 'code-expand'})
+        expand.string = f'Show all {lines} lines'
+        holder.append(expand)
+
+
+def reference_postprocess(body: str) -> tuple[str, dict[str, str]]:
+    html = BeautifulSoup(f'<article>{body}</article>', features='html5lib')
+    for header in html.find('article').find_all(["h2", "h3", "h4"]):
+        header.attrs["id"] = header.text.lower().replace(' ', '-').replace("'", "")
+        anchor = html.new_tag("a", href=f'#{header.attrs["id"]}', **{"data-header": "1"})
+        header.wrap(anchor)
+    html = reference_merge_spans(html)
+    blocks: dict[str, str] = {}
+    reference_collapse_large_code_blocks(html, blocks)
+    return ''.join(str(node) for node in html.find('article').contents), blocks
+
+
+def lxml_postprocess(body: str) -> tuple[str, dict[str, str]]:
+    fragment = generate.parse_fragment(body)
+    generate.add_header_anchors(fragment)
+    fragment = generate.merge_spans(fragment)
+    with tempfile.TemporaryDirectory() as assets_dir:
+        generate.collapse_large_code_blocks(fragment, Path(assets_dir))
+        blocks = {f.name: f.read_text(encoding='utf-8') for f in Path(assets_dir).glob('code-*.html')}
+    return generate.serialize_fragment(fragment), blocks
+
+
+def as_parsed(html: str) -> str:
+    """`html` as an HTML5 parser (a browser) reads it, eg with the implicit <tbody>s"""
+    article = BeautifulSoup(f'<article>{html}</article>', features='html5lib').find('article')
+    return normalize(''.join(str(node) for node in article.contents))
+
+
+def compare(show_diff: bool):
+    # don't run mermaid, diagrams are not markdown
+    directives = {**generate.DIRECTIVES, 'embed-mermaid': lambda ctx, fname: ''}
+
+    bodies = {}
+    for post_file in sorted(Path('blog/raw').glob('*/POST.md')):
+        text = post_file.read_text(encoding='utf-8')
+        meta = generate.PostMetadata.from_text(text, with_series=False)
+        try:
+            text, _ = generate.preprocess(post_file.parent, text, meta, directives)
+        except FileNotFoundError as e:
+            print(f'skipping {post_file.parent.name}: {e}')
+            continue
+        bodies[post_file.parent.name] = generate.convert(text)
+
+    results = {}
+    for name, pipeline in [('html5lib', reference_postprocess), ('lxml', lxml_postprocess)]:
+        start = time.perf_counter()
+        results[name] = {post: pipeline(body) for post, body in bodies.items()}
+        print(f'{name:8} {time.perf_counter() - start:6.2f}s total')
+
+    different = []
+    for post in bodies:
+        (expected_article, expected_blocks), (got_article, got_blocks) = results['html5lib'][post], results['lxml'][post]
+        expected = [as_parsed(expected_article)] + [as_parsed(expected_blocks[f]) for f in sorted(expected_blocks)]
+        got = [as_parsed(got_article)] + [as_parsed(got_blocks[f]) for f in sorted(got_blocks)]
+        if expected == got and sorted(expected_blocks) == sorted(got_blocks):
+            continue
+        different.append(post)
+        if show_diff:
+            sys.stdout.writelines(difflib.unified_diff(''.join(expected).splitlines(keepends=True),
+                                                       ''.join(got).splitlines(keepends=True),
+                                                       f'html5lib/{post}', f'lxml/{post}', n=1))
+    print(f'lxml post-processes {len(bodies) - len(different)}/{len(bodies)} posts like html5lib')
+    if different:
+        print(f'  different: {", ".join(different)}')
+    return not different
+
+
+if __name__ == '__main__':
+    sys.exit(0 if compare(show_diff='--diff' in sys.argv[1:]) else 1)
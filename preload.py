@@ -0,0 +1,74 @@
+"""
+Exports `Link: rel=preload` headers for every page as a Caddy `map` at
+preload.caddy (imported by the Caddyfile), so the browser starts fetching
+what a page needs while it is still receiving the HTML.
+
+The assets come from the page summaries of page_audit.py, in document order:
+- every local stylesheet and script
+- the first image, ignoring images on most pages (the footer's icons)
+"""
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import output
+
+OUT_FILE = Path('preload.caddy')
+# set by the map, the Caddyfile adds the Link header when it's not empty
+PLACEHOLDER = '{preload_links}'
+# the `as` of each kind of asset in PageSummary.assets
+PRELOAD_AS = {
+    'style': 'as=style',
+    'script': 'as=script',
+    'image': 'as=image',
+}
+# images on more than this share of the pages are part of the layout, not of the page
+SHARED_IMAGE_SHARE = 0.5
+
+
+def route(name: str) -> str:
+    """The path a page (relative to blog/html) is served at"""
+    if name == 'index.html':
+        return '/'
+    if name.endswith('/index.html'):
+        return f'/{name[:-len("index.html")]}'
+    return f'/{name}'
+
+
+def page_links(page_route: str, assets: list[list[str]], shared_images: set[str]) -> list[str]:
+    links = []
+    first_image = True
+    for url, kind in assets:
+        if kind not in PRELOAD_AS:
+            continue
+        parts = urlsplit(url)
+        if parts.scheme or parts.netloc or url.startswith('data:'):
+            continue
+        path = urljoin(page_route, url)
+        if kind == 'image':
+            if not first_image or path in shared_images:
+                continue
+            first_image = False
+        links.append(f'<{path}>; rel=preload; {PRELOAD_AS[kind]}')
+    return links
+
+
+def write(summaries: dict[str, dict]) -> int:
+    """Writes the preload map from page_audit's summaries, returns how many pages have preloads"""
+    image_pages = Counter(urljoin(route(name), url) for name, summary in summaries.items()
+                          for url, kind in summary['assets'] if kind == 'image')
+    shared_images = {path for path, count in image_pages.items() if count > len(summaries) * SHARED_IMAGE_SHARE}
+
+    routes = {}
+    for name, summary in sorted(summaries.items()):
+        links = page_links(route(name), summary['assets'], shared_images)
+        if links:
+            routes[route(name)] = ', '.join(links)
+
+    lines = ['# Generated by generate.py, see preload.py',
+             f'map {{path}} {PLACEHOLDER} {{']
+    lines.extend(f'\t{path} "{links}"' for path, links in sorted(routes.items()))
+    lines.append('\tdefault ""')
+    lines.append('}')
+    output.write(OUT_FILE, '\n'.join(lines) + '\n')
+    return len(routes)
@@ -0,0 +1,76 @@
+"""
+Maps every historical url of a post to its current url, and writes the map
+as a Caddy `map` block to redirects.caddy (imported by the Caddyfile), so an
+old link is one exact lookup and a single redirect to the final url.
+
+The historical urls of a post are:
+- /<slug>.html, from when posts were served as flat files
+- /posts/<slug>/ with the slug derived from the title, which posts from
+  before 2024 could be published under
+- /posts/<slug>/ for every slug in the `old_slugs` front matter, for posts
+  which were renamed
+each with and without the trailing slash.
+
+The map is verified on every build: every target must be a page in the
+build output, and no historical url can shadow an existing page or point
+to two posts.
+"""
+from pathlib import Path
+
+import output
+
+OUT_FILE = Path('redirects.caddy')
+OUT_DIR = Path('blog/html')
+# set by the map, the Caddyfile redirects when it's not empty
+PLACEHOLDER = '{old_post_url}'
+# posts from before this year could be published under their title
+TITLE_SLUGS_BEFORE = 2024
+
+
+def historical_paths(meta) -> set[str]:
+    slug = meta.get_slug()
+    old_slugs = set(meta.old_slugs)
+    if meta.date.year < TITLE_SLUGS_BEFORE:
+        old_slugs.add(meta.title_slug)
+    old_slugs.discard(slug)
+    paths = {f'/{s}.html' for s in old_slugs | {slug}}
+    for s in old_slugs:
+        paths.update({f'/posts/{s}', f'/posts/{s}/'})
+    return paths
+
+
+def page_exists(path: str) -> bool:
+    fname = OUT_DIR / path.lstrip('/')
+    return fname.is_file() or (fname / 'index.html').is_file()
+
+
+def build(posts) -> dict[str, str]:
+    """The redirects of every post in `posts` (PostMetadata), as old path -> current path"""
+    redirects: dict[str, str] = {}
+    for meta in posts:
+        target = meta.relative_url
+        if not page_exists(target):
+            raise ValueError(f'Redirect target {target} of "{meta.title}" is not in {OUT_DIR}')
+        for path in historical_paths(meta):
+            if path in redirects and redirects[path] != target:
+                raise ValueError(f'{path} would redirect to both {redirects[path]} and {target}')
+            if page_exists(path):
+                raise ValueError(f'Redirect from {path} to {target} would shadow an existing page')
+            redirects[path] = target
+    return redirects
+
+
+def render(redirects: dict[str, str]) -> str:
+    lines = ['# Generated by generate.py, see redirects.py',
+             f'map {{path}} {PLACEHOLDER} {{']
+    lines.extend(f'\t{path} {target}' for path, target in sorted(redirects.items()))
+    lines.append('\tdefault ""')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def write(posts) -> int:
+    """Writes the redirect map, returns how many redirects it has"""
+    redirects = build(posts)
+    output.write(OUT_FILE, render(redirects))
+    return len(redirects)
@@ -0,0 +1,201 @@
+"""
+Finds related posts by TF-IDF similarity of their text plus tag overlap.
+
+Per-post term counts are cached by content hash, and the similarity matrix
+(sparse, keeping the best KEEP_PER_ROW entries per post) is cached on disk.
+On each build only the rows of new/changed posts are recomputed, and merged
+into the rows of the unchanged posts.
+
+The IDF weights of unchanged rows are not refreshed when other posts change;
+the drift is negligible for a handful of new posts, and deleting the cache
+directory recomputes everything.
+"""
+import hashlib
+import json
+import re
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+from search_index import tokenize
+
+CACHE_DIR = Path('.cache/related')
+# bump when the tokenization/scoring changes, to rebuild everything
+VERSION = 1
+RELATED_COUNT = 3
+KEEP_PER_ROW = 20
+# share of the tag overlap (jaccard) in the similarity, the rest is the text cosine
+TAG_SHARE = 0.3
+MIN_SIMILARITY = 0.05
+# rows of the similarity matrix computed at once, bounds memory use on full rebuilds
+CHUNK_SIZE = 256
+FENCED_CODE_RE = re.compile(r'^```.*?^```', re.M | re.S)
+TITLE_REPEAT = 3
+
+
+def post_terms(meta, text: str) -> Counter[str]:
+    _, _, body = text.split('---', 2)
+    body = FENCED_CODE_RE.sub('', body)
+    terms = Counter(tokenize(body))
+    for term in tokenize(meta.title):
+        terms[term] += TITLE_REPEAT
+    terms.update(tokenize(meta.description or ''))
+    return terms
+
+
+def rows_to_csr(rows: list[list[list[int]]], ncols: int, binary=False) -> sparse.csr_matrix:
+    """Builds a CSR matrix out of [[col, value], ...] rows."""
+    lengths = np.array([len(r) for r in rows], dtype=np.int64)
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    flat = np.array([cv for r in rows for cv in r], dtype=np.float64).reshape(-1, 2)
+    indices = flat[:, 0].astype(np.int64)
+    data = np.ones(len(flat)) if binary else flat[:, 1]
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), ncols))
+
+
+def tfidf(counts: sparse.csr_matrix) -> sparse.csr_matrix:
+    n = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log((1 + n) / (1 + df)) + 1
+    x = counts.copy()
+    x.data = (1 + np.log(x.data)) * idf[x.indices]
+    norms = np.sqrt(np.asarray(x.multiply(x).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ x
+
+
+class RelatedPosts:
+    def __init__(self, state: dict, similarity: sparse.lil_matrix):
+        self.slugs: list[str] = state['slugs']
+        self.posts: dict[str, dict] = state['posts']
+        self.vocab: list[str] = state['vocab']
+        self.tag_vocab: list[str] = state['tag_vocab']
+        self.previous_top: dict[str, list[str]] = state['top']
+        self.similarity = similarity
+
+    @staticmethod
+    def load() -> 'RelatedPosts':
+        state_file = CACHE_DIR / 'state.json'
+        matrix_file = CACHE_DIR / 'similarity.npz'
+        if state_file.exists() and matrix_file.exists():
+            with state_file.open() as fd:
+                state = json.load(fd)
+            if state.get('version') == VERSION:
+                return RelatedPosts(state, sparse.load_npz(matrix_file).tolil())
+        empty = {'slugs': [], 'posts': {}, 'vocab': [], 'tag_vocab': [], 'top': {}}
+        return RelatedPosts(empty, sparse.lil_matrix((0, 0)))
+
+    def update(self, posts: dict[str, tuple]):
+        """`posts` maps the slug of every published post to its (PostMetadata, markdown)"""
+        hashes = {slug: hashlib.sha256(text.encode()).hexdigest() for slug, (_, text) in posts.items()}
+
+        keep = [i for i, slug in enumerate(self.slugs) if slug in posts]
+        if len(keep) != len(self.slugs):
+            self.similarity = self.similarity.tocsr()[keep][:, keep].tolil()
+            self.slugs = [self.slugs[i] for i in keep]
+            self.posts = {slug: self.posts[slug] for slug in self.slugs}
+
+        new = [slug for slug in posts if slug not in self.posts]
+        self.slugs.extend(new)
+        n = len(self.slugs)
+        self.similarity.resize((n, n))
+
+        changed = [slug for slug in self.slugs if self.posts.get(slug, {}).get('hash') != hashes[slug]]
+        if not changed:
+            return
+
+        term_idx = {t: i for i, t in enumerate(self.vocab)}
+        tag_idx = {t: i for i, t in enumerate(self.tag_vocab)}
+        for slug in changed:
+            meta, text = posts[slug]
+            terms = post_terms(meta, text)
+            for t in terms:
+                if t not in term_idx:
+                    term_idx[t] = len(self.vocab)
+                    self.vocab.append(t)
+            for t in meta.tags:
+                if t not in tag_idx:
+                    tag_idx[t] = len(self.tag_vocab)
+                    self.tag_vocab.append(t)
+            self.posts[slug] = {
+                'hash': hashes[slug],
+                'terms': sorted([term_idx[t], c] for t, c in terms.items()),
+                'tags': sorted([tag_idx[t], 1] for t in set(meta.tags)),
+            }
+
+        pos = {slug: i for i, slug in enumerate(self.slugs)}
+        self._update_similarity([pos[slug] for slug in changed])
+
+    def _update_similarity(self, changed: list[int]):
+        rows = [self.posts[slug] for slug in self.slugs]
+        x = tfidf(rows_to_csr([r['terms'] for r in rows], len(self.vocab)))
+        tags = rows_to_csr([r['tags'] for r in rows], len(self.tag_vocab), binary=True)
+        tag_sizes = np.asarray(tags.sum(axis=1)).ravel()
+        x_t = x.T.tocsc()
+        tags_t = tags.T.tocsc()
+
+        changed_set = set(changed)
+        unchanged = [j for j in range(len(self.slugs)) if j not in changed_set]
+        # unchanged rows, without the entries for posts that are being recomputed
+        merged = {j: {c: v for c, v in zip(self.similarity.rows[j], self.similarity.data[j])
+                      if c not in changed_set}
+                  for j in unchanged}
+
+        for start in range(0, len(changed), CHUNK_SIZE):
+            chunk = np.array(changed[start:start + CHUNK_SIZE])
+            cos = (x[chunk] @ x_t).toarray()
+            inter = (tags[chunk] @ tags_t).toarray()
+            union = tag_sizes[chunk][:, None] + tag_sizes[None, :] - inter
+            jaccard = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+            sim = (1 - TAG_SHARE) * cos + TAG_SHARE * jaccard
+            sim[np.arange(len(chunk)), chunk] = 0
+            sim[sim < MIN_SIMILARITY] = 0
+
+            for k, i in enumerate(chunk):
+                best = np.argsort(-sim[k], kind='stable')[:KEEP_PER_ROW]
+                best = np.sort(best[sim[k, best] > 0])
+                self.similarity.rows[i] = best.tolist()
+                self.similarity.data[i] = sim[k, best].tolist()
+
+            # the matrix is symmetric, merge the new values into the unchanged rows
+            for j, row in merged.items():
+                for k in np.flatnonzero(sim[:, j]):
+                    row[int(chunk[k])] = float(sim[k, j])
+                if len(row) > KEEP_PER_ROW:
+                    merged[j] = dict(sorted(row.items(), key=lambda cv: -cv[1])[:KEEP_PER_ROW])
+
+        for j, row in merged.items():
+            cols = sorted(row)
+            self.similarity.rows[j] = cols
+            self.similarity.data[j] = [row[c] for c in cols]
+
+    def __contains__(self, slug: str) -> bool:
+        return slug in self.posts
+
+    def top(self, slug: str, k: int = RELATED_COUNT) -> list[str]:
+        i = self.slugs.index(slug)
+        ranked = sorted(zip(self.similarity.data[i], self.similarity.rows[i]), key=lambda vc: (-vc[0], vc[1]))
+        return [self.slugs[c] for _, c in ranked[:k]]
+
+    def top_changed(self, slug: str) -> bool:
+        """Whether the related posts of `slug` changed since its page was last rendered"""
+        return self.previous_top.get(slug) != self.top(slug)
+
+    def rendered(self, slug: str):
+        self.previous_top[slug] = self.top(slug)
+
+    def save(self):
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        state = {
+            'version': VERSION,
+            'slugs': self.slugs,
+            'posts': self.posts,
+            'vocab': self.vocab,
+            'tag_vocab': self.tag_vocab,
+            'top': {slug: top for slug, top in self.previous_top.items() if slug in self.posts},
+        }
+        with (CACHE_DIR / 'state.json').open('w') as fd:
+            json.dump(state, fd)
+        sparse.save_npz(CACHE_DIR / 'similarity.npz', self.similarity.tocsr())
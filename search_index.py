@@ -0,0 +1,185 @@
+"""
+Builds a static full-text search index for the blog.
+
+The index is an inverted index over titles, tags, descriptions, headings and
+text. It maps term -> [[doc id, score], ...] and is sharded by the first
+two characters of each term, so the browser only fetches the shards for
+the terms it is looking up (see blog/html/js/search.js).
+
+The terms of every post are kept in a cache, so that on each build only the
+shards containing terms of new/changed/removed posts are rewritten.
+"""
+import json
+import re
+from collections import Counter
+from pathlib import Path
+
+import output
+
+CACHE_FILE = Path('.cache/search-index.json')
+OUT_DIR = Path('blog/html/search')
+# bump when the tokenization/scoring changes, to rebuild everything
+VERSION = 2
+
+TITLE_WEIGHT = 10
+HEADING_WEIGHT = 4
+TAG_WEIGHT = 4
+DESCRIPTION_WEIGHT = 3
+BODY_WEIGHT = 1
+
+# must match `tokenize` in search.js
+TOKEN_RE = re.compile(r'\w+')
+SHARD_KEY_RE = re.compile(r'[a-z0-9_]{2}')
+# elements whose text is not indexed as body text
+SKIP_TAGS = {'pre', 'script', 'style', 'h2', 'h3', 'h4'}
+# added by the post-processing after indexing (the cached fragment has them): code block
+# expanders and asciinema placeholders
+SKIP_CLASSES = {'code-expand', 'asciinema-placeholder'}
+STOPWORDS = set('''
+a about after all also an and any are as at be because been but by can could did do does
+doing done for from had has have he her his how i if in into is it its just me more most
+my no not of on once only or other our out over she so some such than that the their them
+then there these they this those through to too under up very was we were what when where
+which while who why will with would you your
+'''.split())
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def shard_key(term: str) -> str:
+    key = term[:2]
+    if SHARD_KEY_RE.fullmatch(key):
+        return key
+    return '__'
+
+
+def body_text(el):
+    """The text inside `el`, except for code blocks, scripts, styles, headings and build-time widgets"""
+    if not isinstance(el.tag, str) or el.tag in SKIP_TAGS:
+        return
+    if SKIP_CLASSES.intersection(el.get('class', '').split()):
+        return
+    if el.text:
+        yield el.text
+    for child in el:
+        yield from body_text(child)
+        if child.tail:
+            yield child.tail
+
+
+def extract_terms(meta, content) -> dict[str, int]:
+    """
+    Scores the terms of a rendered post; `content` is the lxml tree of the post's article.
+    Code blocks are not indexed, inline code is.
+    """
+    scores: Counter[str] = Counter()
+    for term in tokenize(meta.title):
+        scores[term] += TITLE_WEIGHT
+    for term in tokenize(meta.description or ''):
+        scores[term] += DESCRIPTION_WEIGHT
+    for term in tokenize(' '.join(meta.tags)):
+        scores[term] += TAG_WEIGHT
+
+    for header in content.iter('h2', 'h3', 'h4'):
+        for term in tokenize(' '.join(header.itertext())):
+            scores[term] += HEADING_WEIGHT
+    for text in body_text(content):
+        for term in tokenize(text):
+            scores[term] += BODY_WEIGHT
+    return dict(scores)
+
+
+class SearchIndex:
+    def __init__(self, ids: dict[str, int], docs: dict[str, dict]):
+        self.ids = ids
+        self.docs = docs
+        self.dirty_keys: set[str] = set()
+        self.docs_dirty = False
+
+    @staticmethod
+    def load() -> 'SearchIndex':
+        if CACHE_FILE.exists():
+            with CACHE_FILE.open() as fd:
+                data = json.load(fd)
+            if data.get('version') == VERSION:
+                return SearchIndex(data['ids'], data['docs'])
+        index = SearchIndex({}, {})
+        # nothing on disk can be trusted, rewrite every shard
+        index.docs_dirty = True
+        if OUT_DIR.exists():
+            index.dirty_keys.update(f.stem for f in OUT_DIR.glob('*.json') if f.stem != 'docs')
+        return index
+
+    def __contains__(self, slug: str) -> bool:
+        return slug in self.docs
+
+    def add(self, meta, content):
+        slug = meta.get_slug()
+        doc = {
+            'title': meta.get_title(),
+            'url': meta.relative_url,
+            'description': meta.description or '',
+            'date': meta.date.isoformat(),
+            'terms': extract_terms(meta, content),
+        }
+        old = self.docs.get(slug)
+        if old == doc:
+            return
+        if slug not in self.ids:
+            self.ids[slug] = max(self.ids.values(), default=-1) + 1
+        old_terms = old['terms'] if old else {}
+        changed = {t for t in old_terms.keys() | doc['terms'].keys()
+                   if old_terms.get(t) != doc['terms'].get(t)}
+        self.dirty_keys.update(shard_key(t) for t in changed)
+        if old is None or any(old[k] != doc[k] for k in ('title', 'url', 'description', 'date')):
+            self.docs_dirty = True
+        self.docs[slug] = doc
+
+    def remove(self, slug: str):
+        doc = self.docs.pop(slug, None)
+        if doc is None:
+            return
+        self.ids.pop(slug)
+        self.dirty_keys.update(shard_key(t) for t in doc['terms'])
+        self.docs_dirty = True
+
+    def prune(self, keep: set[str]):
+        for slug in set(self.docs) - keep:
+            self.remove(slug)
+
+    def write(self) -> int:
+        """Writes the modified shards; returns how many were written."""
+        OUT_DIR.mkdir(parents=True, exist_ok=True)
+        shards: dict[str, dict[str, list]] = {k: {} for k in self.dirty_keys}
+        for slug, doc in self.docs.items():
+            doc_id = self.ids[slug]
+            for term, score in doc['terms'].items():
+                shard = shards.get(shard_key(term))
+                if shard is None:
+                    continue
+                shard.setdefault(term, []).append([doc_id, score])
+
+        written = 0
+        for key, shard in shards.items():
+            fname = OUT_DIR / f'{key}.json'
+            if not shard:
+                fname.unlink(missing_ok=True)
+                continue
+            for postings in shard.values():
+                postings.sort(key=lambda p: -p[1])
+            written += output.write(fname, json.dumps(shard, separators=(',', ':'), sort_keys=True, ensure_ascii=False))
+
+        if self.docs_dirty:
+            docs = {self.ids[slug]: {'t': d['title'], 'u': d['url'], 'd': d['description'], 'p': d['date']}
+                    for slug, d in self.docs.items()}
+            output.write(OUT_DIR / 'docs.json', json.dumps(docs, separators=(',', ':'), sort_keys=True, ensure_ascii=False))
+
+        CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with CACHE_FILE.open('w') as fd:
+            json.dump({'version': VERSION, 'ids': self.ids, 'docs': self.docs}, fd)
+
+        self.dirty_keys = set()
+        self.docs_dirty = False
+        return written
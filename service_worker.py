@@ -0,0 +1,80 @@
+"""
+Generates the service worker at blog/html/sw.js, from blog/template/sw.js with
+the precache manifest inlined (so that the worker, and its manifest, update
+whenever some content changes).
+
+The manifest maps urls to a hash of their content in the build output:
+- precache: the index and the stylesheets and logo it links to, fetched when
+  the worker installs
+- pages: every post, cached when visited
+The worker only drops, and fetches again, the entries whose hash changed.
+Hashes are kept in .cache/precache.json, and only computed again for the
+files whose mtime/size changed.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import lxml.html
+from jinja2 import Template
+
+import output
+
+TEMPLATE_FILE = Path('blog/template/sw.js')
+OUT_FILE = Path('blog/html/sw.js')
+OUT_DIR = Path('blog/html')
+CACHE_FILE = Path('.cache/precache.json')
+# bump when the hashing changes
+VERSION = 1
+LOGO = '/images/logo.svg'
+# visited posts kept in the cache
+RECENT_PAGES = 20
+
+
+def load_hashes() -> dict[str, list]:
+    if CACHE_FILE.exists():
+        with CACHE_FILE.open() as fd:
+            data = json.load(fd)
+        if data.get('version') == VERSION:
+            return data['files']
+    return {}
+
+
+def url_file(url: str) -> Path:
+    fname = OUT_DIR / url.lstrip('/')
+    return fname / 'index.html' if url.endswith('/') else fname
+
+
+def precache_urls() -> list[str]:
+    """The index, and the stylesheets it links to"""
+    index = lxml.html.parse(str(url_file('/'))).getroot()
+    styles = [href for href in index.xpath('//link[@rel="stylesheet"]/@href') if href.startswith('/')]
+    return ['/', *styles, LOGO]
+
+
+def write(page_urls: list[str]) -> bool:
+    """Writes the service worker for the precached urls and the `page_urls`, returns whether it changed"""
+    previous = load_hashes()
+    hashes: dict[str, list] = {}
+
+    def content_hash(url: str) -> str:
+        fname = url_file(url)
+        st = fname.stat()
+        old = previous.get(url)
+        if old is not None and old[:2] == [st.st_mtime_ns, st.st_size]:
+            hashes[url] = old
+        else:
+            hashes[url] = [st.st_mtime_ns, st.st_size, hashlib.sha256(fname.read_bytes()).hexdigest()[:16]]
+        return hashes[url][2]
+
+    manifest = {
+        'precache': {url: content_hash(url) for url in precache_urls()},
+        'pages': {url: content_hash(url) for url in sorted(page_urls)},
+    }
+    CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with CACHE_FILE.open('w') as fd:
+        json.dump({'version': VERSION, 'files': hashes}, fd)
+
+    template = Template(TEMPLATE_FILE.read_text())
+    rendered = template.render(manifest=json.dumps(manifest, indent=4, sort_keys=True), recent_pages=RECENT_PAGES)
+    return output.write(OUT_FILE, rendered + '\n')
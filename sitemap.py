@@ -0,0 +1,116 @@
+"""
+Writes the sitemap, with a <lastmod> that says when the content of each page
+last changed, instead of when the post was published.
+
+The hash of every page in the sitemap is kept in .cache/sitemap.json (and
+only computed again when the page's mtime/size change). When the hash
+changes, the lastmod of the page becomes the date of the build; a page seen
+for the first time gets the date it was published.
+
+Above MAX_URLS urls, sitemap.xml becomes a sitemap index pointing to shards
+of MAX_URLS urls each (sitemap-<n>.xml). Entries are sharded in the order
+they are given, so adding a post at the end only changes the last shards.
+"""
+import hashlib
+import json
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, asdict
+from datetime import date
+from pathlib import Path
+from typing import Optional
+
+import output
+
+CACHE_FILE = Path('.cache/sitemap.json')
+OUT_DIR = Path('blog/html')
+# bump when the state changes
+VERSION = 1
+MAX_URLS = 1000
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+@dataclass
+class SitemapEntry:
+    url: str
+    # the rendered page, whose content is tracked
+    page: Path
+    # lastmod of the page the first time it is seen
+    published: date
+
+
+@dataclass
+class PageState:
+    mtime_ns: int
+    size: int
+    hash: str
+    lastmod: str
+
+
+def load_state() -> dict[str, PageState]:
+    if CACHE_FILE.exists():
+        with CACHE_FILE.open() as fd:
+            data = json.load(fd)
+        if data.get('version') == VERSION:
+            return {url: PageState(**s) for url, s in data['pages'].items()}
+    return {}
+
+
+def update_lastmods(entries: list[SitemapEntry], today: date) -> dict[str, str]:
+    """Returns the lastmod of every entry, and saves the new state"""
+    previous = load_state()
+    state: dict[str, PageState] = {}
+    for entry in entries:
+        st = entry.page.stat()
+        old = previous.get(entry.url)
+        if old is not None and (old.mtime_ns, old.size) == (st.st_mtime_ns, st.st_size):
+            state[entry.url] = old
+            continue
+        content_hash = hashlib.sha256(entry.page.read_bytes()).hexdigest()
+        if old is None:
+            lastmod = entry.published.isoformat()
+        elif old.hash != content_hash:
+            lastmod = today.isoformat()
+        else:
+            lastmod = old.lastmod
+        state[entry.url] = PageState(st.st_mtime_ns, st.st_size, content_hash, lastmod)
+
+    CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with CACHE_FILE.open('w') as fd:
+        json.dump({'version': VERSION, 'pages': {url: asdict(s) for url, s in state.items()}}, fd)
+    return {url: s.lastmod for url, s in state.items()}
+
+
+def render(kind: str, children: list[tuple[str, str]]) -> bytes:
+    """A <urlset> (kind='url') or a <sitemapindex> (kind='sitemap') of (loc, lastmod)"""
+    root = ET.Element('urlset' if kind == 'url' else 'sitemapindex', xmlns=XMLNS)
+    for loc, lastmod in children:
+        el = ET.SubElement(root, kind)
+        ET.SubElement(el, 'loc').text = loc
+        ET.SubElement(el, 'lastmod').text = lastmod
+    ET.indent(root, space="  ")
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+def write(entries: list[SitemapEntry], base_url: str, today: Optional[date] = None) -> int:
+    """Writes the sitemap (or the sitemap index and its shards), returns how many files were written"""
+    lastmods = update_lastmods(entries, today or date.today())
+    urls = [(e.url, lastmods[e.url]) for e in entries]
+
+    shards: dict[str, list[tuple[str, str]]] = {}
+    if len(urls) > MAX_URLS:
+        for n, start in enumerate(range(0, len(urls), MAX_URLS), 1):
+            shards[f'sitemap-{n}.xml'] = urls[start:start + MAX_URLS]
+
+    written = 0
+    for fname, shard in shards.items():
+        written += output.write(OUT_DIR / fname, render('url', shard))
+    for stale in OUT_DIR.glob('sitemap-*.xml'):
+        if stale.name not in shards:
+            stale.unlink()
+
+    if shards:
+        index = [(f'{base_url}{fname}', max(lastmod for _, lastmod in shard)) for fname, shard in shards.items()]
+        written += output.write(OUT_DIR / 'sitemap.xml', render('sitemap', index))
+    else:
+        written += output.write(OUT_DIR / 'sitemap.xml', render('url', urls))
+    return written
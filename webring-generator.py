@@ -1,12 +1,49 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+import hashlib
 import html
+import json
 import xml.etree.ElementTree as ET
 import requests
 import concurrent.futures
+import lxml.etree
 from jinja2 import Template
+from PIL import Image, features
 
 WEBRING_TEMPLATE_FILE = 'blog/template/webring.html'
 WEBRING_TEMPLATE = Template(open(WEBRING_TEMPLATE_FILE, 'r').read())
+AVATAR_DIR = Path('blog/html/images/webring')
+AVATAR_CACHE_FILE = Path('.cache/webring-avatars.json')
+# avatars are displayed at 32x32 (w-8 h-8), store them at 2x for hidpi screens
+AVATAR_SIZE = 64
+# SVG elements which can run scripts or embed other documents
+SVG_UNSAFE_TAGS = ('script', 'foreignObject', 'iframe', 'object', 'embed', 'handler', 'listener')
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+@dataclass
+class Avatar:
+    webp: str
+    width: int
+    height: int
+    avif: Optional[str] = None
+    svg: Optional[str] = None
+    # upstream validators, to skip re-downloading unchanged images
+    source_hash: str = ''
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @property
+    def src(self) -> str:
+        return self.svg or self.webp
+
+    def files(self) -> list[str]:
+        return [f for f in (self.webp, self.avif, self.svg) if f]
+
+    def exists(self) -> bool:
+        return all((AVATAR_DIR / Path(f).name).exists() for f in self.files())
 
 @dataclass
 class BlogMeta:
@@ -17,6 +54,7 @@ class BlogMeta:
     xml_url: str
     last_post_url: str
     last_post_title: str
+    avatar: Optional[Avatar] = None
 
 def parse_xml(file_path):
     ET.register_namespace('feeder', "https://nononsenseapps.com/feeder")
@@ -81,7 +119,121 @@ def fetch_feed_details(xml_url) -> dict | None:
     except Exception as e:
         print(f"Error fetching description for {xml_url}: {str(e)}")
 
-def parse_blog_meta(entry) -> BlogMeta | None:
+def store_avatar(data: bytes, ext: str) -> str:
+    """
+    Stores the image content-addressed, so that unchanged avatars keep their URL
+    (and browser caches) across builds.
+    """
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    fname = AVATAR_DIR / f'{digest}.{ext}'
+    if not fname.exists():
+        fname.write_bytes(data)
+    return f'/images/webring/{fname.name}'
+
+def encode_image(img: Image.Image, fmt: str) -> bytes:
+    out = BytesIO()
+    img.save(out, format=fmt, quality=80)
+    return out.getvalue()
+
+def sanitize_svg(data: bytes) -> bytes:
+    """
+    Strips scripts, event handlers and external references from a third-party
+    SVG, which is served from this origin and could otherwise run scripts in it
+    when opened directly.
+    """
+    parser = lxml.etree.XMLParser(resolve_entities=False, no_network=True, remove_comments=True, remove_pis=True)
+    root = lxml.etree.fromstring(data, parser)
+    if lxml.etree.QName(root).localname != 'svg':
+        raise ValueError(f'Not an SVG document: <{root.tag}>')
+    for el in list(root.iter()):
+        if not isinstance(el.tag, str):
+            continue
+        tag = lxml.etree.QName(el).localname
+        # <set>/<animate> can swap an attribute for a javascript: url
+        animates_href = tag in ('set', 'animate') and el.get('attributeName', '').endswith('href')
+        if tag in SVG_UNSAFE_TAGS or animates_href:
+            el.getparent().remove(el)
+            continue
+        for attr in list(el.attrib):
+            name = lxml.etree.QName(attr).localname.lower()
+            value = el.attrib[attr].strip()
+            if name.startswith('on'):
+                del el.attrib[attr]
+            elif attr in ('href', XLINK_HREF) and not value.startswith(('#', 'data:image/')):
+                del el.attrib[attr]
+    return lxml.etree.tostring(root, xml_declaration=True, encoding='utf-8')
+
+def build_avatar(data: bytes) -> Avatar:
+    source_hash = hashlib.sha256(data).hexdigest()
+    if data.lstrip()[:5] in (b'<svg ', b'<?xml'):
+        # vector images are already small and scale fine, ship them (sanitized) as-is
+        path = store_avatar(sanitize_svg(data), 'svg')
+        return Avatar(webp='', svg=path, width=AVATAR_SIZE // 2, height=AVATAR_SIZE // 2, source_hash=source_hash)
+
+    img = Image.open(BytesIO(data))
+    if img.format == 'ICO':
+        # .ico files carry multiple sizes, pick the largest one
+        img.size = max(img.ico.sizes())
+    img = img.convert('RGBA')
+    img.thumbnail((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
+    webp = store_avatar(encode_image(img, 'WEBP'), 'webp')
+    avif = None
+    if features.check('avif'):
+        avif = store_avatar(encode_image(img, 'AVIF'), 'avif')
+    return Avatar(webp=webp, avif=avif, width=(img.width + 1) // 2, height=(img.height + 1) // 2, source_hash=source_hash)
+
+def fetch_avatar(image_url: str, cached: Optional[Avatar]) -> Optional[Avatar]:
+    if not image_url:
+        return None
+    headers = {}
+    if cached and cached.exists():
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    try:
+        response = requests.get(image_url, timeout=5, headers=headers)
+        if response.status_code == 304:
+            return cached
+        response.raise_for_status()
+        data = response.content
+        if cached and cached.exists() and cached.source_hash == hashlib.sha256(data).hexdigest():
+            avatar = cached
+        else:
+            avatar = build_avatar(data)
+        avatar.etag = response.headers.get('ETag')
+        avatar.last_modified = response.headers.get('Last-Modified')
+        return avatar
+    except Exception as e:
+        print(f"Error fetching avatar {image_url}: {str(e)}")
+        # keep serving the last known good copy
+        if cached and cached.exists():
+            return cached
+        return None
+
+def load_avatar_cache() -> dict[str, Avatar]:
+    if not AVATAR_CACHE_FILE.exists():
+        return {}
+    with AVATAR_CACHE_FILE.open() as fd:
+        return {url: Avatar(**a) for url, a in json.load(fd).items()}
+
+def save_avatar_cache(avatars: dict[str, Avatar], image_urls: set[str], previous: dict[str, Avatar]):
+    """
+    Saves the avatars fetched in this run; blogs still in the list whose fetch
+    failed keep their previous avatar, so a flaky feed doesn't cost a download.
+    """
+    avatars = {url: a for url, a in previous.items() if url in image_urls and a.exists()} | avatars
+    AVATAR_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with AVATAR_CACHE_FILE.open('w') as fd:
+        json.dump({url: asdict(a) for url, a in avatars.items()}, fd, indent=2, sort_keys=True)
+
+    # drop avatars which are no longer referenced (blog unfollowed/image changed)
+    referenced = {Path(f).name for a in avatars.values() for f in a.files()}
+    for f in AVATAR_DIR.iterdir():
+        if f.name not in referenced:
+            f.unlink()
+
+def parse_blog_meta(avatar_cache: dict[str, Avatar], entry) -> BlogMeta | None:
     title = entry.get('title', 'No Title').replace('+', ' ')
     title = html.escape(title)
     xml_url = entry.get('xmlUrl', '#')
@@ -105,13 +257,19 @@ def parse_blog_meta(entry) -> BlogMeta | None:
     last_post_url = details['last_post_url']
     last_post_title = details['last_post_title']
 
-    return BlogMeta(image_url=image_url, title=title, url=url, last_post_title=last_post_title, last_post_url=last_post_url, xml_url=xml_url)
+    avatar = fetch_avatar(image_url, avatar_cache.get(image_url))
+
+    return BlogMeta(image_url=image_url, title=title, url=url, last_post_title=last_post_title, last_post_url=last_post_url, xml_url=xml_url, avatar=avatar)
 
 def generate_html_page(entries):
+    AVATAR_DIR.mkdir(parents=True, exist_ok=True)
+    avatar_cache = load_avatar_cache()
     with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        blogs = list(executor.map(parse_blog_meta, entries))
+        blogs = list(executor.map(partial(parse_blog_meta, avatar_cache), entries))
 
     blogs = [c for c in blogs if c]
+    image_urls = {e.get('{https://nononsenseapps.com/feeder}imageUrl', '') for e in entries}
+    save_avatar_cache({b.image_url: b.avatar for b in blogs if b.avatar}, image_urls, avatar_cache)
     blogs = sorted(blogs, key=lambda b: b.title.strip().lower())
 
     html_content = WEBRING_TEMPLATE.render(blogs=blogs)